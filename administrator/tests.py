@@ -1,5 +1,14 @@
+from unittest import mock
+
 from django.contrib.auth import get_user_model, authenticate
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from voting.ballot import get_ballot_version
+from voting.models import Candidate, Position, Voter
+from voting.votes import record_ballot, results_by_position
 
 # Get the CustomUser model we defined in account/models.py
 CustomUser = get_user_model()
@@ -67,3 +76,324 @@ class AuthenticationTests(TestCase):
         """Test authentication with an incorrect password fails."""
         user = authenticate(email=self.email, password='wrong-password')
         self.assertIsNone(user)
+
+
+class DashboardTests(TestCase):
+    """Tests related to the cached admin dashboard."""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = CustomUser.objects.create_superuser(
+            email='admin@example.com', password='pass', first_name='Ad', last_name='Min')
+        self.client.force_login(self.admin)
+        self.president = Position.objects.create(name='President', max_vote=1, priority=1)
+        Position.objects.create(name='Treasurer', max_vote=1, priority=2)
+        self.alice = Candidate.objects.create(
+            fullname='Alice', bio='-', photo='candidates/a.jpg', position=self.president)
+        Candidate.objects.create(
+            fullname='Bob', bio='-', photo='candidates/b.jpg', position=self.president)
+        user = CustomUser.objects.create_user(
+            email='voter@example.com', password='pass', first_name='Vo', last_name='Ter')
+        self.voter = Voter.objects.create(admin=user, phone='08000000000')
+
+    def test_results_come_from_one_query(self):
+        """Positions, candidates and tallies are read with a single query."""
+        with self.assertNumQueries(1):
+            results = results_by_position()
+        self.assertEqual([p['name'] for p in results], ['President', 'Treasurer'])
+        self.assertEqual(results[1]['candidates'], [])
+
+    def test_dashboard_refreshes_after_a_vote(self):
+        """The cached dashboard is replaced once a ballot is recorded."""
+        response = self.client.get(reverse('adminDashboard'))
+        self.assertEqual(response.context['voted_voters_count'], 0)
+        self.assertEqual(response.context['chart_data']['President']['votes'], [0, 0])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_ballot(self.voter, {self.president.id: [self.alice.id]})
+        response = self.client.get(reverse('adminDashboard'))
+        self.assertEqual(response.context['voted_voters_count'], 1)
+        self.assertEqual(response.context['chart_data']['President']['votes'], [1, 0])
+
+    def test_outcome_escapes_candidate_names(self):
+        """A candidate name is shown as text, never as markup."""
+        self.alice.fullname = '<script>alert(1)</script>'
+        self.alice.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            record_ballot(self.voter, {self.president.id: [self.alice.id]})
+        response = self.client.get(reverse('adminDashboard'))
+        self.assertNotContains(response, '<script>alert(1)</script>')
+        self.assertContains(response, 'Winner : &lt;script&gt;alert(1)&lt;/script&gt;')
+
+    def test_result_pdf_is_cached_until_votes_change(self):
+        """Repeat downloads are served from cache; a new vote re-renders."""
+        url = reverse('printResult')
+        first = self.client.get(url)
+        with mock.patch('administrator.views.results_by_position') as results:
+            second = self.client.get(url)
+        results.assert_not_called()
+        self.assertEqual(first.content, second.content)
+        self.assertIn('attachment', second['Content-Disposition'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_ballot(self.voter, {self.president.id: [self.alice.id]})
+        with mock.patch('administrator.views.results_by_position', return_value=[]) as results:
+            self.client.get(url)
+        results.assert_called_once()
+
+    def test_result_pdf_is_rendered_again_after_ballot_changes(self):
+        """Renaming a candidate re-renders the cached PDF."""
+        url = reverse('printResult')
+        self.client.get(url)
+        self.alice.fullname = 'Alicia'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.save()
+        with mock.patch('administrator.views.results_by_position', return_value=[]) as results:
+            self.client.get(url)
+        results.assert_called_once()
+
+
+class VotesDataTests(TestCase):
+    """Tests related to the paged votes table endpoint."""
+
+    def setUp(self):
+        cache.clear()
+        admin = CustomUser.objects.create_superuser(
+            email='admin@example.com', password='pass', first_name='Ad', last_name='Min')
+        self.client.force_login(admin)
+        self.president = Position.objects.create(name='President', max_vote=1, priority=1)
+        self.alice = Candidate.objects.create(
+            fullname='Alice', bio='-', photo='candidates/a.jpg', position=self.president)
+        self.bob = Candidate.objects.create(
+            fullname='Bob', bio='-', photo='candidates/b.jpg', position=self.president)
+        for i in range(5):
+            user = CustomUser.objects.create_user(
+                email=f'voter{i}@example.com', password='pass', first_name=f'V{i}', last_name='Ter')
+            voter = Voter.objects.create(admin=user, phone=f'0800000000{i}')
+            choice = self.alice if i % 2 else self.bob
+            # The last two voters are stored as packed ballots
+            with override_settings(VOTE_STORAGE='ballots' if i >= 3 else 'rows'):
+                record_ballot(voter, {self.president.id: [choice.id]})
+
+    def pages(self, **params):
+        rows, cursor, start = [], '', 0
+        while cursor is not None:
+            response = self.client.get(reverse('votes_data'), dict(
+                params, length=2, start=start, cursor=cursor, draw=1)).json()
+            rows.extend(response['data'])
+            cursor, start = response['next'], start + 2
+        return rows, response
+
+    def test_pages_cover_both_storages_once(self):
+        """Following the cursors returns every vote exactly once."""
+        rows, last = self.pages()
+        self.assertEqual(sorted(row[0] for row in rows), [f'Ter, V{i}' for i in range(5)])
+        self.assertEqual(last['recordsFiltered'], 5)
+
+    def test_filter_by_candidate(self):
+        """Only votes for the chosen candidate are returned."""
+        rows, last = self.pages(candidate=self.alice.id)
+        self.assertEqual(sorted(row[0] for row in rows), ['Ter, V1', 'Ter, V3'])
+        self.assertEqual(last['recordsTotal'], 5)
+
+    def test_page_query_count_does_not_grow_with_rows(self):
+        """Voter, candidate and position are loaded with the page."""
+        with self.assertNumQueries(4):
+            # session, user, the page of rows and the tallies
+            self.client.get(reverse('votes_data'), {'length': 2})
+
+    def test_bad_cursor_is_rejected(self):
+        """A malformed cursor gets a 400 rather than a server error."""
+        self.assertEqual(
+            self.client.get(reverse('votes_data'), {'cursor': 'rows:x'}).status_code, 400)
+
+
+class VotersDataTests(TestCase):
+    """Tests related to the paged voters table endpoint."""
+
+    def setUp(self):
+        cache.clear()
+        admin = CustomUser.objects.create_superuser(
+            email='admin@example.com', password='pass', first_name='Ad', last_name='Min')
+        self.client.force_login(admin)
+        for i in range(5):
+            user = CustomUser.objects.create_user(
+                email=f'voter{i}@example.com', password='pass', first_name=f'V{i}', last_name='<b>Ter</b>')
+            Voter.objects.create(admin=user, phone=f'0800000000{i}')
+
+    def test_pages_and_search(self):
+        """Cursors walk the voters in id order; the search box filters by prefix."""
+        url = reverse('voters_data')
+        first = self.client.get(url, {'length': 3}).json()
+        second = self.client.get(url, {'length': 3, 'cursor': first['next']}).json()
+        self.assertEqual([row[1] for row in first['data'] + second['data']], [f'V{i}' for i in range(5)])
+        self.assertIsNone(second['next'])
+        self.assertEqual(first['recordsTotal'], 5)
+        self.assertEqual(first['data'][0][0], '&lt;b&gt;Ter&lt;/b&gt;')
+
+        found = self.client.get(url, {'search[value]': 'voter3'}).json()
+        self.assertEqual([row[1] for row in found['data']], ['V3'])
+        self.assertEqual(found['recordsFiltered'], 1)
+
+
+class LookupTests(TestCase):
+    """Tests related to the batched lookup behind the edit/delete modals."""
+
+    def setUp(self):
+        cache.clear()
+        admin = CustomUser.objects.create_superuser(
+            email='admin@example.com', password='pass', first_name='Ad', last_name='Min')
+        self.client.force_login(admin)
+        self.voters = []
+        for i in range(3):
+            user = CustomUser.objects.create_user(
+                email=f'voter{i}@example.com', password='pass', first_name=f'V{i}', last_name='Ter')
+            self.voters.append(Voter.objects.create(admin=user, phone=f'0800000000{i}'))
+        self.president = Position.objects.create(name='President', max_vote=1, priority=1)
+
+    def test_many_rows_in_one_query(self):
+        """Voters and their users come from a single query; unknown ids are left out."""
+        ids = ','.join(str(voter.id) for voter in self.voters) + ',999'
+        with self.assertNumQueries(3):
+            # session, user, voters
+            response = self.client.get(reverse('lookup'), {'type': 'voter', 'ids': ids})
+        rows = response.json()['rows']
+        self.assertEqual(sorted(rows), sorted(str(voter.id) for voter in self.voters))
+        self.assertEqual(rows[str(self.voters[1].id)]['email'], 'voter1@example.com')
+
+    def test_etag_changes_with_the_rows(self):
+        """A repeat request gets a 304 until the position is edited."""
+        params = {'type': 'position', 'ids': str(self.president.id)}
+        first = self.client.get(reverse('lookup'), params)
+        self.assertFalse(first.json()['rows'][str(self.president.id)]['ranked'])
+        again = self.client.get(reverse('lookup'), params, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+        self.president.ranked = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.president.save()
+        changed = self.client.get(reverse('lookup'), params, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertTrue(changed.json()['rows'][str(self.president.id)]['ranked'])
+
+    def test_unknown_type_is_rejected(self):
+        """Only voters, positions and candidates can be looked up."""
+        response = self.client.get(reverse('lookup'), {'type': 'user', 'ids': '1'})
+        self.assertEqual(response.status_code, 400)
+
+
+class DeleteJobTests(TestCase):
+    """Tests related to the delete views and the progress of their background jobs."""
+
+    def setUp(self):
+        cache.clear()
+        admin = CustomUser.objects.create_superuser(
+            email='admin@example.com', password='pass', first_name='Ad', last_name='Min')
+        self.client.force_login(admin)
+        self.president = Position.objects.create(name='President', max_vote=1, priority=1)
+
+    def test_delete_redirects_with_job(self):
+        """The delete starts a job whose progress the list page can poll."""
+        with mock.patch('voting.deletion.threading.Thread') as thread:
+            response = self.client.post(reverse('deletePosition'), {'id': self.president.id})
+        job_id = response['Location'].split('?job=')[1]
+        self.assertEqual(response['Location'], reverse('viewPositions') + '?job=' + job_id)
+        self.assertEqual(thread.call_args.kwargs['args'], (job_id, 'position', self.president.id))
+        thread.return_value.start.assert_called_once_with()
+
+        status = self.client.get(reverse('delete_job', args=[job_id])).json()
+        self.assertEqual((status['kind'], status['finished']), ('position', False))
+        self.assertEqual(self.client.get(reverse('delete_job', args=['nope'])).status_code, 404)
+
+    def test_unknown_object_starts_nothing(self):
+        """Deleting a missing candidate reports it and starts no job."""
+        with mock.patch('voting.deletion.threading.Thread') as thread:
+            response = self.client.post(reverse('deleteCandidate'), {'id': 999})
+        self.assertEqual(response['Location'], reverse('viewCandidates'))
+        thread.assert_not_called()
+
+
+class PaperBallotsViewTests(TestCase):
+    """Tests related to uploading paper ballot counts."""
+
+    def setUp(self):
+        cache.clear()
+        admin = CustomUser.objects.create_superuser(
+            email='admin@example.com', password='pass', first_name='Ad', last_name='Min')
+        self.client.force_login(admin)
+        president = Position.objects.create(name='President', max_vote=1, priority=1)
+        self.candidate = Candidate.objects.create(
+            fullname='Ada', bio='-', photo='candidates/x.jpg', position=president)
+
+    def test_upload_adds_to_results(self):
+        """An uploaded file of ballots counts towards the results; a bad one imports nothing."""
+        upload = SimpleUploadedFile('s1.csv', f"station,president\nS1,{self.candidate.id}\n".encode())
+        response = self.client.post(reverse('import_paper_ballots'), {'file': upload})
+        self.assertRedirects(response, reverse('viewVotes'), fetch_redirect_response=False)
+        self.assertEqual(results_by_position()[0]['candidates'][0]['votes'], 1)
+
+        upload = SimpleUploadedFile('s2.csv', b"station,mayor\nS2,1\n")
+        response = self.client.post(reverse('import_paper_ballots'), {'file': upload}, follow=True)
+        self.assertContains(response, "Nothing was imported: Unknown positions: mayor")
+
+
+class ExportViewTests(TestCase):
+    """Tests related to the vote and result downloads."""
+
+    def setUp(self):
+        admin = CustomUser.objects.create_superuser(
+            email='admin@example.com', password='pass', first_name='Ad', last_name='Min')
+        self.client.force_login(admin)
+
+    def test_streamed_download(self):
+        """Exports are streamed attachments; unknown formats are not found."""
+        response = self.client.get(reverse('export_votes', args=['csv']))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="votes.csv"')
+        self.assertEqual(b''.join(response.streaming_content).decode().splitlines(),
+                         ['voter_id,last_name,first_name,position_id,position,candidate_id,candidate'])
+        self.assertEqual(self.client.get(reverse('export_results', args=['ndjson']))['Content-Type'],
+                         'application/x-ndjson')
+        self.assertEqual(self.client.get(reverse('export_votes', args=['xml'])).status_code, 404)
+
+
+class BallotReorderTests(TestCase):
+    """Tests related to saving the ballot order."""
+
+    def setUp(self):
+        cache.clear()
+        admin = CustomUser.objects.create_superuser(
+            email='admin@example.com', password='pass', first_name='Ad', last_name='Min')
+        self.client.force_login(admin)
+        self.positions = [
+            Position.objects.create(name=f'Position {i}', max_vote=1, priority=i) for i in range(1, 6)]
+
+    def order(self):
+        return list(Position.objects.order_by('priority').values_list('id', flat=True))
+
+    def test_whole_order_saved_at_once(self):
+        """The new order is written in one UPDATE and the ballot version bumped once."""
+        new_order = [position.id for position in reversed(self.positions)]
+        version = get_ballot_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post(reverse('reorder_ballot_positions'), {'order[]': new_order})
+        self.assertFalse(response.json()['error'])
+        self.assertEqual(self.order(), new_order)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(get_ballot_version(), version + 1)
+
+    def test_incomplete_order_is_rejected(self):
+        """An order missing a position changes nothing."""
+        before = self.order()
+        response = self.client.post(reverse('reorder_ballot_positions'), {'order[]': before[:-1]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.order(), before)
+
+    def test_move_up_swaps_neighbours(self):
+        """The single-step endpoint still works, through the same bulk update."""
+        first, second = self.positions[0].id, self.positions[1].id
+        response = self.client.get(reverse('update_ballot_position', args=[second, 'up']))
+        self.assertEqual(response.json()['message'], "Moved Up")
+        self.assertEqual(self.order()[:2], [second, first])
+        response = self.client.get(reverse('update_ballot_position', args=[second, 'up']))
+        self.assertTrue(response.json()['error'])
@@ -6,12 +6,11 @@ urlpatterns = [
     path('', views.dashboard, name="adminDashboard"),
     # * Voters
     path('voters', views.voters, name="adminViewVoters"),
-    path('voters/view', views.view_voter_by_id, name="viewVoter"),
+    path('voters/data', views.voters_data, name="voters_data"),
     path('voters/delete', views.deleteVoter, name='deleteVoter'),
     path('voters/update', views.updateVoter, name="updateVoter"),
 
     # * Position
-    path('position/view', views.view_position_by_id, name="viewPosition"),
     path('position/update', views.updatePosition, name="updatePosition"),
     path('position/delete', views.deletePosition, name='deletePosition'),
     path('positions/view', views.viewPositions, name='viewPositions'),
@@ -20,17 +19,28 @@ urlpatterns = [
     path('candidate/', views.viewCandidates, name='viewCandidates'),
     path('candidate/update', views.updateCandidate, name="updateCandidate"),
     path('candidate/delete', views.deleteCandidate, name='deleteCandidate'),
-    path('candidate/view', views.view_candidate_by_id, name='viewCandidate'),
+
+    # * Rows for the edit/delete modals
+    path('lookup', views.lookup, name='lookup'),
+
+    # * Progress of background deletes
+    path('jobs/<str:job_id>', views.delete_job, name='delete_job'),
 
     # * Settings (Ballot Position and Election Title)
     path("settings/ballot/position", views.ballot_position, name='ballot_position'),
     path("settings/ballot/title/", views.ballot_title, name='ballot_title'),
     path("settings/ballot/position/update/<int:position_id>/<str:up_or_down>/",
          views.update_ballot_position, name='update_ballot_position'),
+    path("settings/ballot/position/reorder/",
+         views.reorder_ballot_positions, name='reorder_ballot_positions'),
 
     # * Votes
     path('votes/view', views.viewVotes, name='viewVotes'),
+    path('votes/data', views.votes_data, name='votes_data'),
     path('votes/reset/', views.resetVote, name='resetVote'),
+    path('votes/paper/', views.import_paper_ballots, name='import_paper_ballots'),
+    path('votes/export/votes.<str:fmt>', views.export_data, {'kind': 'votes'}, name='export_votes'),
+    path('votes/export/results.<str:fmt>', views.export_data, {'kind': 'results'}, name='export_results'),
     path('votes/print/', views.PrintView.as_view(), name='printResult'),
 
 
@@ -1,31 +1,36 @@
+import hashlib
+import io
+
 from django.conf import settings
 from django.contrib import messages
-from django.http import JsonResponse
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, reverse, redirect
+from django.utils.html import escape
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag
 from django_renderpdf.views import PDFView
 
 from account.forms import CustomUserForm
 from voting.forms import *
-
-
-def find_n_winners(data, n):
-    """Read More
-    https://www.geeksforgeeks.org/python-program-to-find-n-largest-elements-from-a-list/
-    """
-    final_list = []
-    candidate_data = data[:]
-    # print("Candidate = ", str(candidate_data))
-    for i in range(0, n):
-        0
-        if len(candidate_data) == 0:
-            continue
-        this_winner = max(candidate_data, key=lambda x: x['votes'])
-        # TODO: Check if None
-        this = this_winner['name'] + \
-            " with " + str(this_winner['votes']) + " votes"
-        final_list.append(this)
-        candidate_data.remove(this_winner)
-    return ", &nbsp;".join(final_list)
+from voting.ballot import get_ballot_version, reorder_positions
+from voting.context_processors import get_election_title
+from voting.deletion import get_job, start_delete
+from voting.export import CONTENT_TYPES, export
+from voting.paper import InvalidPaperImport, import_paper
+from voting.storage import votes_page
+from voting.stv import tally_ranked_positions
+from voting.tally import describe_outcome, tally_positions
+from voting.voter_index import get_index_version, search_voters
+from voting.votes import get_tallies, get_vote_version, reset_election, results_by_position
+
+RESULT_PDF_CACHE_SECONDS = 60 * 60
+VOTES_PAGE_SIZE = 50
+VOTES_PAGE_MAX = 500
+VOTERS_PAGE_SIZE = 50
+VOTERS_PAGE_MAX = 500
+LOOKUP_MAX_IDS = 500
 
 
 class PrintView(PDFView):
@@ -36,99 +41,77 @@ class PrintView(PDFView):
     def download_name(self):
         return "result.pdf"
 
+    def get(self, request, *args, **kwargs):
+        if self.allow_force_html and request.GET.get('html', False):
+            return super().get(request, *args, **kwargs)
+
+        # The PDF only changes with the votes, the ballot or the election title
+        self.title = get_election_title()
+        title_hash = hashlib.md5(self.title.encode()).hexdigest()
+        cache_key = f"administrator:result_pdf:{get_vote_version()}:{get_ballot_version()}:{title_hash}"
+        pdf = cache.get(cache_key)
+        if pdf is None:
+            response = super().get(request, *args, **kwargs)
+            cache.set(cache_key, response.content, RESULT_PDF_CACHE_SECONDS)
+            return response
+
+        response = HttpResponse(pdf, content_type="application/pdf")
+        response['Content-Disposition'] = f'attachment; filename="{self.download_name}"'
+        return response
+
     def get_context_data(self, *args, **kwargs):
         """E-voting"""
-        try:
-            file = open(settings.ELECTION_TITLE_PATH, 'r')
-            file.read()
-        except:
-            pass
         context = super().get_context_data(**kwargs)
+        context['title'] = getattr(self, 'title', None) or get_election_title()
         position_data = {}
-        for position in Position.objects.all():
-            candidate_data = []
-            ""
-            for candidate in Candidate.objects.filter(position=position):
-                this_candidate_data = {}
-                votes = Votes.objects.filter(candidate=candidate).count()
-                this_candidate_data['name'] = candidate.fullname
-                this_candidate_data['votes'] = votes
-                candidate_data.append(this_candidate_data)
-            print("Candidate Data For  ", str(
-                position.name), " = ", str(candidate_data))
-            # ! Check Winner
-            if len(candidate_data) < 1:
-                winner = "Position does not have candidates"
-            else:
-                # Check if max_vote is more than 1
-                if position.max_vote > 1:
-                    winner = find_n_winners(candidate_data, position.max_vote)
-                else:
-
-                    winner = max(candidate_data, key=lambda x: x['votes'])
-                    if winner['votes'] == 0:
-                        winner = "No one voted for this yet position, yet."
-                    else:
-                        """
-                        https://stackoverflow.com/questions/18940540/how-can-i-count-the-occurrences-of-an-item-in-a-list-of-dictionaries
-                        """
-                        count = sum(1 for d in candidate_data if d.get(
-                            'votes') == winner['votes'])
-                        if count > 1:
-                            winner = f"There are {count} candidates with {winner['votes']} votes"
-                        else:
-                            winner = "Winner : " + winner['name']
-            print("Candidate Data For  ", str(
-                position.name), " = ", str(candidate_data))
-            position_data[position.name] = {
-                'candidate_data': candidate_data, 'winner': winner, 'max_vote': position.max_vote}
+        for position in tally_ranked_positions(tally_positions(results_by_position())):
+            position_data[position['name']] = {
+                'candidate_data': position['candidates'],
+                'winner': describe_outcome(position),
+                'max_vote': position['max_vote'],
+            }
         context['positions'] = position_data
-        print(context)
         return context
 
 
 def dashboard(request):
-    positions = Position.objects.all().order_by('priority')
-    candidates = Candidate.objects.all()
-    voters = Voter.objects.all()
-    voted_voters = Voter.objects.filter(voted=1)
-    []
-    []
-    chart_data = {}
-
-    for position in positions:
-        list_of_candidates = []
-        votes_count = []
-        for candidate in Candidate.objects.filter(position=position):
-            list_of_candidates.append(candidate.fullname)
-            votes = Votes.objects.filter(candidate=candidate).count()
-            votes_count.append(votes)
-        chart_data[position] = {
-            'candidates': list_of_candidates,
-            'votes': votes_count,
-            'pos_id': position.id
+    # Admins poll this page; the aggregates are cached per vote/ballot version
+    cache_key = f"administrator:dashboard:{get_vote_version()}:{get_ballot_version()}"
+    context = cache.get(cache_key)
+    if context is None:
+        positions = tally_ranked_positions(tally_positions(results_by_position()))
+        for position in positions:
+            position['outcome'] = describe_outcome(position)
+        voters = Voter.objects.aggregate(
+            total=Count('id'), voted=Count('id', filter=Q(voted=True)))
+        chart_data = {}
+        for position in positions:
+            chart_data[position['name']] = {
+                'candidates': [candidate['name'] for candidate in position['candidates']],
+                'votes': [candidate['votes'] for candidate in position['candidates']],
+                'pos_id': position['id']
+            }
+        context = {
+            'position_count': len(positions),
+            'candidate_count': sum(len(position['candidates']) for position in positions),
+            'voters_count': voters['total'],
+            'voted_voters_count': voters['voted'],
+            'positions': positions,
+            'chart_data': chart_data,
+            'page_title': "Dashboard"
         }
+        cache.set(cache_key, context, getattr(settings, 'VOTE_TALLY_CACHE_SECONDS', 5))
 
-    context = {
-        'position_count': positions.count(),
-        'candidate_count': candidates.count(),
-        'voters_count': voters.count(),
-        'voted_voters_count': voted_voters.count(),
-        'positions': positions,
-        'chart_data': chart_data,
-        'page_title': "Dashboard"
-    }
     return render(request, "admin/home.html", context)
 
 
 def voters(request):
-    voters = Voter.objects.all()
+    # The table itself is filled page by page from voters_data
     userForm = CustomUserForm(request.POST or None)
     voterForm = VoterForm(request.POST or None)
     context = {
         'form1': userForm,
         'form2': voterForm,
-        'voters': voters,
         'page_title': 'Voters List'
     }
     if request.method == 'POST':
@@ -144,36 +127,41 @@ def voters(request):
     return render(request, "admin/voters.html", context)
 
 
-def view_voter_by_id(request):
-    voter_id = request.GET.get('id', None)
-    voter = Voter.objects.filter(id=voter_id)
-    context = {}
-    if not voter.exists():
-        context['code'] = 404
-    else:
-        context['code'] = 200
-        voter = voter[0]
-        context['first_name'] = voter.admin.first_name
-        context['last_name'] = voter.admin.last_name
-        context['phone'] = voter.phone
-        context['id'] = voter.id
-        context['email'] = voter.admin.email
-    return JsonResponse(context)
-
-
-def view_position_by_id(request):
-    pos_id = request.GET.get('id', None)
-    pos = Position.objects.filter(id=pos_id)
-    context = {}
-    if not pos.exists():
-        context['code'] = 404
-    else:
-        context['code'] = 200
-        pos = pos[0]
-        context['name'] = pos.name
-        context['max_vote'] = pos.max_vote
-        context['id'] = pos.id
-    return JsonResponse(context)
+def voters_data(request):
+    """
+    One page of the voters table for DataTables' server-side mode, paged by
+    keyset on the voter id (the client sends back 'next'). The search box
+    is a prefix search over names, email and phone, answered from the
+    in-process index in voting/voter_index.py.
+    """
+    try:
+        draw = int(request.GET.get('draw', 0))
+        after = int(request.GET.get('cursor') or 0)
+        length = int(request.GET.get('length', VOTERS_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': "Invalid request"}, status=400)
+    if not 0 < length <= VOTERS_PAGE_MAX:
+        length = VOTERS_PAGE_SIZE
+
+    matching, voter_ids = search_voters(request.GET.get('search[value]', ''), after, length + 1)
+    voters = list(Voter.objects.select_related('admin').filter(id__in=voter_ids[:length]).order_by('id'))
+    return JsonResponse({
+        'draw': draw,
+        'recordsTotal': matching,
+        'recordsFiltered': matching,
+        'next': voters[-1].id if len(voter_ids) > length and voters else None,
+        'data': [
+            [
+                escape(voter.admin.last_name),
+                escape(voter.admin.first_name),
+                escape(voter.admin.email),
+                escape(voter.phone),
+                f"<button class='btn btn-success btn-sm edit btn-flat' data-id='{voter.id}'><i class='fa fa-edit'></i> Edit</button> "
+                f"<button class='btn btn-danger btn-sm delete btn-flat' data-id='{voter.id}'><i class='fa fa-trash'></i> Delete</button>",
+            ]
+            for voter in voters
+        ],
+    })
 
 
 def updateVoter(request):
@@ -195,14 +183,7 @@ def updateVoter(request):
 def deleteVoter(request):
     if request.method != 'POST':
         messages.error(request, "Access Denied")
-    try:
-        admin = Voter.objects.get(id=request.POST.get('id')).admin
-        admin.delete()
-        messages.success(request, "Voter Has Been Deleted")
-    except:
-        messages.error(request, "Access To This Resource Denied")
-
-    return redirect(reverse('adminViewVoters'))
+    return _start_delete(request, 'voter', Voter, 'adminViewVoters')
 
 
 def viewPositions(request):
@@ -241,22 +222,18 @@ def updatePosition(request):
 def deletePosition(request):
     if request.method != 'POST':
         messages.error(request, "Access Denied")
-    try:
-        pos = Position.objects.get(id=request.POST.get('id'))
-        pos.delete()
-        messages.success(request, "Position Has Been Deleted")
-    except:
-        messages.error(request, "Access To This Resource Denied")
-
-    return redirect(reverse('viewPositions'))
+    return _start_delete(request, 'position', Position, 'viewPositions')
 
 
 def viewCandidates(request):
-    candidates = Candidate.objects.all()
+    candidates = Candidate.objects.select_related('position')
     form = CandidateForm(request.POST or None, request.FILES or None)
     context = {
         'candidates': candidates,
         'form1': form,
+        # Filled in from lookup when a row's edit button is clicked; the
+        # photo is optional there since the current one is kept
+        'form2': CandidateForm(auto_id='edit_%s', use_required_attribute=False),
         'page_title': 'Candidates'
     }
     if request.method == 'POST':
@@ -290,29 +267,94 @@ def updateCandidate(request):
 def deleteCandidate(request):
     if request.method != 'POST':
         messages.error(request, "Access Denied")
+    return _start_delete(request, 'candidate', Candidate, 'viewCandidates')
+
+
+def _start_delete(request, kind, model, next_page):
+    # The votes go in the background (see voting/deletion.py); the page
+    # polls delete_job with the id it is redirected with
     try:
-        pos = Candidate.objects.get(id=request.POST.get('id'))
-        pos.delete()
-        messages.success(request, "Candidate Has Been Deleted")
+        instance = model.objects.get(id=request.POST.get('id'))
     except:
         messages.error(request, "Access To This Resource Denied")
+        return redirect(reverse(next_page))
+    job_id = start_delete(kind, instance.id)
+    messages.info(request, f"Deleting {kind.title()}")
+    return redirect(reverse(next_page) + '?job=' + job_id)
+
+
+def delete_job(request, job_id):
+    job = get_job(job_id)
+    if job is None:
+        return JsonResponse({'error': "Unknown job"}, status=404)
+    return JsonResponse(job)
+
+
+def _voter_row(voter):
+    return {
+        'id': voter.id,
+        'first_name': voter.admin.first_name,
+        'last_name': voter.admin.last_name,
+        'email': voter.admin.email,
+        'phone': voter.phone,
+    }
 
-    return redirect(reverse('viewCandidates'))
+
+def _position_row(position):
+    return {
+        'id': position.id,
+        'name': position.name,
+        'max_vote': position.max_vote,
+        'ranked': position.ranked,
+    }
 
 
-def view_candidate_by_id(request):
-    candidate_id = request.GET.get('id', None)
-    candidate = Candidate.objects.filter(id=candidate_id)
-    context = {}
-    if not candidate.exists():
-        context['code'] = 404
-    else:
-        candidate = candidate[0]
-        context['code'] = 200
-        context['fullname'] = candidate.fullname
-        previous = CandidateForm(instance=candidate)
-        context['form'] = str(previous.as_p())
-    return JsonResponse(context)
+def _candidate_row(candidate):
+    return {
+        'id': candidate.id,
+        'fullname': candidate.fullname,
+        'bio': candidate.bio,
+        'position': candidate.position_id,
+        'photo': candidate.photo.url if candidate.photo else '',
+    }
+
+
+# type: (queryset, row serializer, version that changes with the rows)
+LOOKUPS = {
+    'voter': (lambda: Voter.objects.select_related('admin'), _voter_row, get_index_version),
+    'position': (lambda: Position.objects.all(), _position_row, get_ballot_version),
+    'candidate': (lambda: Candidate.objects.all(), _candidate_row, get_ballot_version),
+}
+
+
+def lookup_etag(request):
+    kind = request.GET.get('type')
+    if kind not in LOOKUPS:
+        return None
+    version = LOOKUPS[kind][2]()
+    return hashlib.md5(f"{kind}:{version}:{request.GET.get('ids', '')}".encode()).hexdigest()
+
+
+@etag(lookup_etag)
+@cache_control(private=True, no_cache=True)
+def lookup(request):
+    """
+    Rows for the edit and delete modals, many at once:
+    ?type=voter|position|candidate&ids=1,2,3 gives {'rows': {id: {...}}},
+    leaving out ids that do not exist.
+    """
+    kind = request.GET.get('type')
+    try:
+        ids = [int(i) for i in request.GET.get('ids', '').split(',') if i]
+    except ValueError:
+        ids = None
+    if kind not in LOOKUPS or ids is None or len(ids) > LOOKUP_MAX_IDS:
+        return JsonResponse({'error': "Invalid request"}, status=400)
+
+    queryset, row, _ = LOOKUPS[kind]
+    return JsonResponse({
+        'rows': {pk: row(obj) for pk, obj in queryset().in_bulk(ids).items()},
+    })
 
 
 def ballot_position(request):
@@ -323,41 +365,47 @@ def ballot_position(request):
 
 
 def update_ballot_position(request, position_id, up_or_down):
-    global context
-    try:
-        context = {
-            'error': False
-        }
-        position = Position.objects.get(id=position_id)
-        if up_or_down == 'up':
-            priority = position.priority - 1
-            if priority == 0:
-                context['error'] = True
-                output = "This position is already at the top"
-            else:
-                Position.objects.filter(priority=priority).update(
-                    priority=(priority+1))
-                position.priority = priority
-                position.save()
-                output = "Moved Up"
-        else:
-            priority = position.priority + 1
-            if priority > Position.objects.all().count():
-                output = "This position is already at the bottom"
-                context['error'] = True
-            else:
-                Position.objects.filter(priority=priority).update(
-                    priority=(priority-1))
-                position.priority = priority
-                position.save()
-                output = "Moved Down"
-        context['message'] = output
-    except Exception as e:
-        context['message'] = e
-
+    context = {
+        'error': False
+    }
+    order = list(Position.objects.order_by('priority', 'id').values_list('id', flat=True))
+    if position_id not in order:
+        context['error'] = True
+        context['message'] = "Position not found"
+        return JsonResponse(context)
+
+    index = order.index(position_id)
+    if up_or_down == 'up':
+        if index == 0:
+            context['error'] = True
+            context['message'] = "This position is already at the top"
+            return JsonResponse(context)
+        order[index - 1], order[index] = order[index], order[index - 1]
+        context['message'] = "Moved Up"
+    else:
+        if index == len(order) - 1:
+            context['error'] = True
+            context['message'] = "This position is already at the bottom"
+            return JsonResponse(context)
+        order[index], order[index + 1] = order[index + 1], order[index]
+        context['message'] = "Moved Down"
+    reorder_positions(order)
     return JsonResponse(context)
 
 
+def reorder_ballot_positions(request):
+    """Save a whole new ballot order (position ids, top first) at once"""
+    if request.method != 'POST':
+        return JsonResponse({'error': True, 'message': "Invalid request"}, status=405)
+    try:
+        order = [int(position_id) for position_id in request.POST.getlist('order[]')]
+        reorder_positions(order)
+    except ValueError:
+        return JsonResponse(
+            {'error': True, 'message': "The ballot changed, please reload the page"}, status=400)
+    return JsonResponse({'error': False, 'message': "Ballot order saved"})
+
+
 def ballot_title(request):
     from urllib.parse import urlparse
     url = urlparse(request.META['HTTP_REFERER']).path
@@ -377,16 +425,91 @@ def ballot_title(request):
 
 
 def viewVotes(request):
-    votes = Votes.objects.all()
+    # The table itself is filled page by page from votes_data
     context = {
-        'votes': votes,
+        'positions': Position.objects.order_by('priority', 'id'),
+        'candidates': Candidate.objects.select_related('position').order_by('position__priority', 'fullname'),
         'page_title': 'Votes'
     }
     return render(request, "admin/votes.html", context)
 
 
+def votes_data(request):
+    """
+    One page of the votes table for DataTables' server-side mode. Pages are
+    read by keyset: the client sends back the 'next' cursor of the previous
+    page. Counts come from the cached tallies, so they are cheap but may
+    lag the rows by a few seconds.
+    """
+    try:
+        draw = int(request.GET.get('draw', 0))
+        start = max(int(request.GET.get('start', 0)), 0)
+        length = int(request.GET.get('length', VOTES_PAGE_SIZE))
+        if not 0 < length <= VOTES_PAGE_MAX:
+            length = VOTES_PAGE_SIZE
+        position_id = int(request.GET['position']) if request.GET.get('position') else None
+        candidate_id = int(request.GET['candidate']) if request.GET.get('candidate') else None
+        votes, next_cursor = votes_page(
+            request.GET.get('cursor', ''), length, position_id, candidate_id)
+    except ValueError:
+        return JsonResponse({'error': "Invalid request"}, status=400)
+
+    tallies = get_tallies()
+    total = sum(tallies.values())
+    if candidate_id is not None:
+        matching = tallies.get(candidate_id, 0)
+    elif position_id is not None:
+        matching = sum(tallies.get(cid, 0) for cid in
+                       Candidate.objects.filter(position_id=position_id).values_list('id', flat=True))
+    else:
+        matching = total
+    # Keep the estimate consistent with what paging has actually seen
+    shown = start + len(votes)
+    matching = max(matching, shown + 1) if next_cursor else shown
+
+    return JsonResponse({
+        'draw': draw,
+        'recordsTotal': max(total, matching),
+        'recordsFiltered': matching,
+        'next': next_cursor,
+        'data': [
+            [escape(str(vote.voter)), escape(str(vote.candidate)), escape(str(vote.position))]
+            for vote in votes
+        ],
+    })
+
+
+def export_data(request, kind, fmt):
+    # Streamed: the download starts at once and the whole table is never in memory
+    if fmt not in CONTENT_TYPES:
+        raise Http404
+    response = StreamingHttpResponse(export(kind, fmt), content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
+
+def import_paper_ballots(request):
+    # See voting/paper.py for the two file formats
+    upload = request.FILES.get('file')
+    if request.method != 'POST' or upload is None:
+        messages.error(request, "Choose a CSV file to import")
+        return redirect(reverse('viewVotes'))
+    try:
+        results = import_paper(io.TextIOWrapper(upload, encoding='utf-8-sig', newline=''))
+    except (InvalidPaperImport, UnicodeDecodeError) as e:
+        messages.error(request, f"Nothing was imported: {e}")
+        return redirect(reverse('viewVotes'))
+    outcomes = [outcome for station, outcome in results.values()]
+    imported = outcomes.count('imported')
+    skipped = outcomes.count('already imported')
+    messages.success(request, f"{imported} stations imported, {skipped} already imported")
+    for code, (station, outcome) in results.items():
+        if outcome not in ('imported', 'already imported'):
+            messages.error(request, f"{code}: {outcome}")
+    return redirect(reverse('viewVotes'))
+
+
 def resetVote(request):
-    Votes.objects.all().delete()
-    Voter.objects.all().update(voted=False, verified=False, otp=None)
+    reset_election()
     messages.success(request, "All votes has been reset")
     return redirect(reverse('viewVotes'))
@@ -156,3 +156,46 @@ ELECTION_TITLE_PATH = os.path.join(
     BASE_DIR, 'election_title.txt')  # Election Title File
 
 SEND_OTP = True  # If you toggle this to False, kindly use 0000 as your OTP
+
+# The ballot, vote and voter index versions, cached results and the progress
+# of background deletes live in the default cache, so every process serving
+# the site must share it. The local memory cache only suits one process
+# (runserver, or gunicorn with a single worker): set REDIS_URL (and
+# pip install redis) before running several workers.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Also keep the rendered ballot in the Django cache (useful with several workers
+# sharing a cache backend). The ballot is always cached per process.
+BALLOT_SHARED_CACHE = False
+
+# Number of VoteTally rows per candidate. More shards mean less contention on
+# popular candidates when several ballots are written at once.
+VOTE_TALLY_SHARDS = 8
+
+# How long (in seconds) summed tallies and the admin dashboard are cached
+VOTE_TALLY_CACHE_SECONDS = 5
+
+# Render the voter ballot in the browser from fetch_ballot?format=json. The
+# ballot definition is cached by a service worker and the submission is
+# queued and retried until it reaches the server.
+CLIENT_SIDE_BALLOT = False
+
+# Show each voter the candidates of every position in their own (fixed)
+# order to even out position bias on the ballot.
+ROTATE_BALLOT = False
+
+# How cast votes are stored: 'rows' (one Votes row per selection) or
+# 'ballots' (one Ballot row per voter with packed candidate ids)
+VOTE_STORAGE = 'rows'
@@ -5,4 +5,9 @@ from .models import *
 admin.site.register(Voter)
 admin.site.register(Position)
 admin.site.register(Candidate)
-admin.site.register(Votes)
\ No newline at end of file
+admin.site.register(Votes)
+admin.site.register(Ballot)
+admin.site.register(Ranking)
+admin.site.register(VoteTally)
+admin.site.register(Station)
+admin.site.register(PaperTally)
@@ -0,0 +1,246 @@
+"""
+Election archives: a snapshot of positions, candidates, tallies and every
+vote in one compact file, readable without the database.
+
+Layout: MAGIC, the length of the manifest (8 bytes, little-endian), the
+manifest as JSON, then the columns. Each column is a typed array (or, for
+names, a JSON list) compressed on its own with zlib; the manifest records
+its type, offset and length for every table. Voter ids are stored as
+deltas, since votes are written in voter order.
+
+ElectionArchive memory-maps the file and decompresses a column only when a
+query first needs it, so opening an archive reads just the manifest.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections import Counter
+from itertools import accumulate
+
+from django.db import transaction
+from django.utils import timezone
+
+from .context_processors import get_election_title
+from .models import Ballot, Candidate, Position, Ranking, Station, Voter, Votes
+from .storage import BALLOT_CHUNK_SIZE, unpack_ids
+from .stv import tally_ranked_positions
+from .tally import tally_positions
+from .votes import get_tallies
+
+MAGIC = b'EVARCHIVE\n'
+FORMAT_VERSION = 1
+
+
+class InvalidArchive(Exception):
+    pass
+
+
+def _encode(kind, values, delta=False):
+    if kind == 'str':
+        return zlib.compress(json.dumps(values).encode())
+    column = array(kind, values)
+    if delta and column:
+        column = array(kind, [column[0]]) + array(kind, map(int.__sub__, column[1:], column))
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return zlib.compress(column.tobytes())
+
+
+def _decode(kind, data, delta=False):
+    data = zlib.decompress(data)
+    if kind == 'str':
+        return json.loads(data)
+    column = array(kind)
+    column.frombytes(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    if delta:
+        column = array(kind, accumulate(column))
+    return column
+
+
+def _snapshot():
+    """{table: {column: (type, values, delta)}} and the manifest's counts, read in one transaction"""
+    vote_voters, vote_candidates = array('i'), array('I')
+    rank_voters, rank_positions, rank_lengths, rank_candidates = array('i'), array('I'), array('I'), array('I')
+    with transaction.atomic():
+        positions = list(Position.objects.order_by('priority', 'id').values_list(
+            'id', 'name', 'max_vote', 'ranked'))
+        candidates = list(Candidate.objects.order_by('id').values_list('id', 'position_id', 'fullname'))
+        tallies = get_tallies(fresh=True)
+        # A voter's votes are all in one storage
+        rows = Votes.objects.order_by('voter_id', 'position_id', 'candidate_id').values_list(
+            'voter_id', 'candidate_id').iterator(chunk_size=BALLOT_CHUNK_SIZE)
+        for voter_id, candidate_id in rows:
+            vote_voters.append(voter_id)
+            vote_candidates.append(candidate_id)
+        ballots = Ballot.objects.order_by('voter_id').values_list(
+            'voter_id', 'candidates').iterator(chunk_size=BALLOT_CHUNK_SIZE)
+        for voter_id, blob in ballots:
+            chosen = unpack_ids(blob)
+            vote_voters.extend([voter_id] * len(chosen))
+            vote_candidates.extend(chosen)
+        rankings = Ranking.objects.order_by('voter_id', 'position_id').values_list(
+            'voter_id', 'position_id', 'candidates').iterator(chunk_size=BALLOT_CHUNK_SIZE)
+        for voter_id, position_id, blob in rankings:
+            ranking = unpack_ids(blob)
+            rank_voters.append(voter_id)
+            rank_positions.append(position_id)
+            rank_lengths.append(len(ranking))
+            rank_candidates.extend(ranking)
+        counts = {
+            'voters': Voter.objects.count(),
+            'voted': Voter.objects.filter(voted=True).count(),
+            'stations': Station.objects.count(),
+            'paper_ballots': sum(Station.objects.exclude(ballots=None).values_list('ballots', flat=True)),
+        }
+
+    tables = {
+        'positions': {
+            'id': ('I', [p[0] for p in positions], False),
+            'name': ('str', [p[1] for p in positions], False),
+            'max_vote': ('I', [p[2] for p in positions], False),
+            'ranked': ('B', [p[3] for p in positions], False),
+        },
+        'candidates': {
+            'id': ('I', [c[0] for c in candidates], False),
+            'position_id': ('I', [c[1] for c in candidates], False),
+            'name': ('str', [c[2] for c in candidates], False),
+        },
+        'tallies': {
+            'candidate_id': ('I', list(tallies), False),
+            'votes': ('Q', list(tallies.values()), False),
+        },
+        'votes': {
+            'voter_id': ('i', vote_voters, True),
+            'candidate_id': ('I', vote_candidates, False),
+        },
+        'rankings': {
+            'voter_id': ('i', rank_voters, True),
+            'position_id': ('I', rank_positions, False),
+            'length': ('I', rank_lengths, False),
+            'candidate_id': ('I', rank_candidates, False),
+        },
+    }
+    return tables, counts
+
+
+def write_archive(path):
+    """Snapshot the election into `path` (replaced atomically); returns the manifest"""
+    tables, counts = _snapshot()
+    manifest = dict(
+        counts, format_version=FORMAT_VERSION, title=get_election_title(),
+        created_at=timezone.now().isoformat(), tables={})
+    blobs, offset = [], 0
+    for table, columns in tables.items():
+        spec = manifest['tables'][table] = {'rows': 0, 'columns': {}}
+        for name, (kind, values, delta) in columns.items():
+            blob = _encode(kind, values, delta)
+            spec['rows'] = len(values)
+            spec['columns'][name] = {'type': kind, 'delta': delta, 'offset': offset, 'length': len(blob)}
+            blobs.append(blob)
+            offset += len(blob)
+
+    header = json.dumps(manifest).encode()
+    partial = f"{path}.partial"
+    with open(partial, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(partial, path)
+    return manifest
+
+
+class ElectionArchive:
+    """A written archive, queried without the database"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise InvalidArchive(f"{path} is not an election archive")
+        start = len(MAGIC) + 8
+        if self._map[:len(MAGIC)] != MAGIC or len(self._map) < start:
+            self.close()
+            raise InvalidArchive(f"{path} is not an election archive")
+        (size,) = struct.unpack_from('<Q', self._map, len(MAGIC))
+        self.manifest = json.loads(self._map[start:start + size])
+        if self.manifest.get('format_version') != FORMAT_VERSION:
+            self.close()
+            raise InvalidArchive(f"{path} has an unsupported format version")
+        self._data = start + size
+        self._columns = {}
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def column(self, table, name):
+        key = (table, name)
+        if key not in self._columns:
+            spec = self.manifest['tables'][table]['columns'][name]
+            start = self._data + spec['offset']
+            self._columns[key] = _decode(spec['type'], self._map[start:start + spec['length']], spec['delta'])
+        return self._columns[key]
+
+    def ranking_groups(self):
+        """{position_id: {ranking tuple: number of voters}}, as storage.ranking_groups"""
+        groups, flat, start = {}, self.column('rankings', 'candidate_id'), 0
+        for position_id, length in zip(self.column('rankings', 'position_id'), self.column('rankings', 'length')):
+            groups.setdefault(position_id, Counter())[tuple(flat[start:start + length])] += 1
+            start += length
+        return groups
+
+    def results(self):
+        """The tallied positions, as the dashboard shows them (see votes.results_by_position)"""
+        tallies = dict(zip(self.column('tallies', 'candidate_id'), self.column('tallies', 'votes')))
+        positions = [
+            {'id': position_id, 'name': name, 'max_vote': max_vote, 'ranked': bool(ranked), 'candidates': []}
+            for position_id, name, max_vote, ranked in zip(
+                self.column('positions', 'id'), self.column('positions', 'name'),
+                self.column('positions', 'max_vote'), self.column('positions', 'ranked'))
+        ]
+        by_id = {position['id']: position for position in positions}
+        for candidate_id, position_id, name in zip(
+                self.column('candidates', 'id'), self.column('candidates', 'position_id'),
+                self.column('candidates', 'name')):
+            by_id[position_id]['candidates'].append(
+                {'id': candidate_id, 'name': name, 'votes': tallies.get(candidate_id, 0)})
+        return tally_ranked_positions(tally_positions(positions), self.ranking_groups())
+
+    def turnout(self):
+        """
+        {'voters', 'voted', 'turnout', 'paper_ballots', 'positions'}, where
+        'positions' is {position_id: number of voters who voted for it}
+        """
+        position_of = dict(zip(self.column('candidates', 'id'), self.column('candidates', 'position_id')))
+        positions = Counter()
+        voter, seen = None, set()
+        # Votes are stored voter by voter
+        for voter_id, candidate_id in zip(self.column('votes', 'voter_id'), self.column('votes', 'candidate_id')):
+            if voter_id != voter:
+                positions.update(seen)
+                voter, seen = voter_id, set()
+            seen.add(position_of.get(candidate_id))
+        positions.update(seen)
+        positions.pop(None, None)
+        voters, voted = self.manifest['voters'], self.manifest['voted']
+        return {
+            'voters': voters,
+            'voted': voted,
+            'turnout': voted / voters if voters else 0.0,
+            'paper_ballots': self.manifest['paper_ballots'],
+            'positions': dict(positions),
+        }
@@ -0,0 +1,344 @@
+"""
+Ballot rendering and caching.
+
+The ballot only changes when an administrator edits positions or
+candidates, so it is rendered once and reused until one of the signal
+handlers in voting/signals.py bumps the ballot version. The version is kept
+in the cache, which every process must share for an edit to reach them all
+(see CACHES in settings).
+"""
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.html import escape
+from django.utils.text import slugify
+
+from .models import Position, Candidate
+
+BALLOT_VERSION_KEY = 'voting:ballot_version'
+BALLOT_FRAGMENTS_KEY = 'voting:ballot_fragments:%s'
+
+# (version, object) pairs last built by this process
+_rendered = (None, None)
+_schema = (None, None)
+
+
+class InvalidBallot(Exception):
+    pass
+
+
+class BallotSchema:
+    """
+    Lookup tables compiled from positions and candidates, used to validate
+    a submitted ballot without querying the database.
+    """
+
+    def __init__(self, version, positions, candidates):
+        self.version = version
+        self.positions = {position.id: position for position in positions}
+        self.order = [position.id for position in positions]
+        self.form_keys = {}
+        for position in positions:
+            key = slugify(position.name)
+            self.form_keys[key] = position.id
+            self.form_keys[f"{key}[]"] = position.id
+        self.ranked = {position.id for position in positions if position.ranked}
+        self.candidate_position = {}
+        self.candidate_names = {}
+        self.position_size = dict.fromkeys(self.order, 0)
+        for candidate in candidates:
+            self.candidate_position[candidate.id] = candidate.position_id
+            self.candidate_names[candidate.id] = candidate.fullname
+            self.position_size[candidate.position_id] += 1
+        self._data = None
+
+    def as_data(self, voter_id=None):
+        """
+        The ballot as plain data, for clients that render it themselves. With
+        a voter id, candidates are ordered as in BallotFragments.html.
+        """
+        if voter_id is not None:
+            rng = random.Random(voter_id)
+            data = self.as_data()
+            return dict(data, positions=[
+                dict(position, candidates=rng.sample(position['candidates'], len(position['candidates'])))
+                if len(position['candidates']) > 1 else position
+                for position in data['positions']
+            ])
+        if self._data is None:
+            by_position = {position_id: [] for position_id in self.order}
+            for candidate_id in sorted(self.candidate_position):
+                by_position[self.candidate_position[candidate_id]].append({
+                    'id': candidate_id,
+                    'fullname': self.candidate_names[candidate_id],
+                })
+            positions = []
+            for position_id in self.order:
+                position = self.positions[position_id]
+                key = slugify(position.name)
+                multiple = position.max_vote > 1
+                if position.ranked:
+                    field, input_type = key, 'rank'
+                elif multiple:
+                    field, input_type = f"{key}[]", 'checkbox'
+                else:
+                    field, input_type = key, 'radio'
+                positions.append({
+                    'id': position.id,
+                    'name': position.name,
+                    'key': key,
+                    'field': field,
+                    'input': input_type,
+                    'max_vote': position.max_vote,
+                    'candidates': by_position[position_id],
+                })
+            self._data = {'version': self.version, 'positions': positions}
+        return self._data
+
+    def clean(self, data):
+        """
+        Map a POSTed ballot to {position_id: [candidate_id, ...]} in ballot
+        order. Unknown form keys (csrf token, submit button) are ignored.
+
+        Ranked positions are posted as one "<key>:<candidate id>" field per
+        candidate holding its rank (blank when unranked); their candidates
+        come back in order of preference.
+        """
+        selections = {}
+        ranks = {}
+        for form_key, values in data.lists():
+            form_key, _, ranked_id = form_key.partition(':')
+            position_id = self.form_keys.get(form_key)
+            if position_id is None:
+                continue
+            position = self.positions[position_id]
+            if (position_id in self.ranked) != bool(ranked_id):
+                raise InvalidBallot(f"Invalid selection for {position.name}")
+            if ranked_id:
+                self._clean_rank(position, ranked_id, values[-1], ranks.setdefault(position_id, {}))
+                continue
+            chosen = selections.setdefault(position_id, [])
+            for value in values:
+                candidate_id = self._candidate(position, value)
+                if candidate_id not in chosen:
+                    chosen.append(candidate_id)
+            if len(chosen) > position.max_vote:
+                raise InvalidBallot(
+                    f"You can only select {position.max_vote} for {position.name}")
+        for position_id, by_rank in ranks.items():
+            selections[position_id] = [by_rank[rank] for rank in sorted(by_rank)]
+        return {
+            position_id: selections[position_id]
+            for position_id in self.order
+            if selections.get(position_id)
+        }
+
+    def _candidate(self, position, value):
+        try:
+            candidate_id = int(value)
+        except (TypeError, ValueError):
+            raise InvalidBallot(f"Invalid selection for {position.name}")
+        if self.candidate_position.get(candidate_id) != position.id:
+            raise InvalidBallot(f"Invalid selection for {position.name}")
+        return candidate_id
+
+    def _clean_rank(self, position, ranked_id, value, by_rank):
+        candidate_id = self._candidate(position, ranked_id)
+        if value == '':
+            return
+        try:
+            rank = int(value)
+        except (TypeError, ValueError):
+            raise InvalidBallot(f"Invalid ranking for {position.name}")
+        if not 1 <= rank <= self.position_size[position.id]:
+            raise InvalidBallot(f"Invalid ranking for {position.name}")
+        if rank in by_rank:
+            raise InvalidBallot(f"Each rank can only be used once for {position.name}")
+        by_rank[rank] = candidate_id
+
+
+def get_ballot_version():
+    version = cache.get(BALLOT_VERSION_KEY)
+    if version is None:
+        # Seed with the clock so a flushed cache never reuses an old version
+        cache.add(BALLOT_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(BALLOT_VERSION_KEY)
+    return version
+
+
+def bump_ballot_version():
+    global _rendered, _schema
+    try:
+        cache.incr(BALLOT_VERSION_KEY)
+    except ValueError:
+        cache.set(BALLOT_VERSION_KEY, time.time_ns(), None)
+    _rendered = (None, None)
+    _schema = (None, None)
+
+
+def renumber_positions():
+    """Close gaps in Position.priority so the ballot order is 1..N"""
+    positions = list(Position.objects.order_by('priority', 'id'))
+    changed = []
+    for num, position in enumerate(positions, start=1):
+        if position.priority != num:
+            position.priority = num
+            changed.append(position)
+    if changed:
+        Position.objects.bulk_update(changed, ['priority'])
+
+
+def reorder_positions(position_ids):
+    """
+    Put the positions in the order of `position_ids`, which must list every
+    position exactly once, with one bulk UPDATE in one transaction. The
+    ballot version is bumped once, after the commit. Returns the number of
+    positions that moved.
+    """
+    with transaction.atomic():
+        positions = Position.objects.select_for_update().in_bulk()
+        if len(position_ids) != len(positions) or set(position_ids) != set(positions):
+            raise ValueError("The new order must list every position exactly once")
+        changed = []
+        for priority, position_id in enumerate(position_ids, start=1):
+            position = positions[position_id]
+            if position.priority != priority:
+                position.priority = priority
+                changed.append(position)
+        if changed:
+            # bulk_update sends no post_save, so bump the version here
+            Position.objects.bulk_update(changed, ['priority'])
+            transaction.on_commit(bump_ballot_version)
+    return len(changed)
+
+
+class BallotFragments:
+    """
+    The ballot HTML split into per-position head/tail markup around one
+    fragment per candidate, so a per-voter candidate order is only a join.
+    """
+
+    def __init__(self, sections):
+        # [(head, [candidate fragment, ...], tail), ...] in ballot order
+        self.sections = sections
+        self._html = None
+
+    def html(self, voter_id=None):
+        """
+        The full ballot. With a voter id, candidates within each position
+        are permuted by a generator seeded from it, so a voter always sees
+        the same order while the order varies across voters.
+        """
+        if voter_id is None:
+            if self._html is None:
+                self._html = "".join(
+                    head + "".join(fragments) + tail
+                    for head, fragments, tail in self.sections
+                )
+            return self._html
+
+        rng = random.Random(voter_id)
+        parts = []
+        for head, fragments, tail in self.sections:
+            parts.append(head)
+            parts.extend(rng.sample(fragments, len(fragments)) if len(fragments) > 1 else fragments)
+            parts.append(tail)
+        return "".join(parts)
+
+
+def render_ballot():
+    positions = list(Position.objects.order_by('priority', 'id'))
+    candidates_by_position = {position.id: [] for position in positions}
+    for candidate in Candidate.objects.order_by('id').only('id', 'fullname', 'position_id'):
+        candidates_by_position[candidate.position_id].append(candidate)
+
+    sections = []
+    for position in positions:
+        key = slugify(position.name)
+        candidates = candidates_by_position[position.id]
+        if position.ranked:
+            instruction = "Rank the candidates in order of preference, 1 being your first choice"
+            options = '<option value=""></option>' + "".join(
+                f'<option value="{rank}">{rank}</option>' for rank in range(1, len(candidates) + 1))
+            fragments = [
+                f"""
+                <li>
+                    <select class="{key}" name="{key}:{candidate.id}">{options}</select>
+                    <span>{escape(candidate.fullname)}</span>
+                </li>
+            """
+                for candidate in candidates
+            ]
+        else:
+            if position.max_vote > 1:
+                instruction = f"You may select up to {position.max_vote} candidates"
+                input_type, input_name = "checkbox", f"{key}[]"
+            else:
+                instruction = "Select only one candidate"
+                input_type, input_name = "radio", key
+
+            fragments = [
+                f"""
+                <li>
+                    <input type="{input_type}" value="{candidate.id}" class="flat-red {key}" name="{input_name}">
+                    <span>{escape(candidate.fullname)}</span>
+                </li>
+            """
+                for candidate in candidates
+            ]
+
+        head = f"""
+        <div class="box box-solid" style="background-color: #f0f4f8; border-radius: 8px; padding: 10px; margin-bottom: 15px;">
+            <div class="box-header with-border">
+                <h3 class="box-title" style="color: #1f2937;"><b>{escape(position.name)}</b></h3>
+            </div>
+            <div class="box-body">
+                <p style="color: #4b5563;">{instruction}</p>
+                <ul style="list-style-type: none; padding-left: 0;">"""
+        tail = """</ul>
+            </div>
+        </div>
+        """
+        sections.append((head, fragments, tail))
+
+    return BallotFragments(sections)
+
+
+def get_ballot_fragments():
+    global _rendered
+    version = get_ballot_version()
+    if _rendered[0] == version:
+        return _rendered[1]
+
+    shared = getattr(settings, 'BALLOT_SHARED_CACHE', False)
+    fragments = cache.get(BALLOT_FRAGMENTS_KEY % version) if shared else None
+    if fragments is None:
+        fragments = render_ballot()
+        if shared:
+            cache.set(BALLOT_FRAGMENTS_KEY % version, fragments, None)
+
+    _rendered = (version, fragments)
+    return fragments
+
+
+def get_ballot_html(voter_id=None):
+    """The cached ballot, with candidates in the voter's order if voter_id is given"""
+    return get_ballot_fragments().html(voter_id)
+
+
+def get_ballot_schema():
+    global _schema
+    version = get_ballot_version()
+    if _schema[0] == version:
+        return _schema[1]
+
+    schema = BallotSchema(
+        version,
+        list(Position.objects.order_by('priority', 'id')),
+        list(Candidate.objects.order_by('id').only('id', 'fullname', 'position_id')),
+    )
+    _schema = (version, schema)
+    return schema
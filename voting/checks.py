@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    # Ballot versions, the voter index journal and delete jobs are kept in
+    # the default cache; in one that is not shared, no other worker sees them
+    if settings.CACHES.get('default', {}).get('BACKEND') in PER_PROCESS_CACHES:
+        return [Warning(
+            "The default cache is not shared between processes.",
+            hint="Run a single worker, or set REDIS_URL (see CACHES in settings).",
+            id='voting.W001',
+        )]
+    return []
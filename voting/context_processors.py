@@ -1,13 +1,17 @@
 from django.conf import settings
 
 
-def ElectionTitle(request):
-    context = {}
+def get_election_title():
     title = "No Title Yet"
     try:
-        file = open(settings.ELECTION_TITLE_PATH, 'r')
-        title = file.read()
+        with open(settings.ELECTION_TITLE_PATH, 'r') as file:
+            title = file.read()
     except:
         pass
-    context['TITLE'] = title
+    return title
+
+
+def ElectionTitle(request):
+    context = {}
+    context['TITLE'] = get_election_title()
     return context
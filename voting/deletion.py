@@ -0,0 +1,109 @@
+"""
+Deleting positions, candidates and voters in the background.
+
+Deleting a position cascades through its candidates to every vote cast
+for them. Done with one .delete() this is one long write transaction,
+which on SQLite blocks ballot submissions until it ends. Here the votes (and
+rankings) are removed first in small chunks, each in its own short
+transaction, and only then the object itself, whose cascade is left with
+little to do.
+
+Jobs run in a thread of the web process. Their progress is kept in the
+cache, where the admin pages poll it (see administrator.views.delete_job);
+the poll may be served by another worker, so the cache must be shared (see
+CACHES in settings).
+"""
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Candidate, Position, Ranking, Voter, Votes
+
+DELETE_JOB_KEY = 'voting:delete_job:%s'
+DELETE_JOB_TIMEOUT = 60 * 60
+DELETE_CHUNK_SIZE = 1000
+
+
+def get_job(job_id):
+    return cache.get(DELETE_JOB_KEY % job_id)
+
+
+def _save_job(job_id, job):
+    cache.set(DELETE_JOB_KEY % job_id, job, DELETE_JOB_TIMEOUT)
+
+
+def _delete_in_chunks(queryset, progress, chunk_size):
+    """Delete `queryset` a chunk of ids at a time, calling progress(removed) after each"""
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return
+        removed = queryset.model.objects.filter(id__in=ids).delete()[0]
+        progress(removed)
+
+
+def _delete_position(position_id, progress, chunk_size):
+    position = Position.objects.get(id=position_id)
+    _delete_in_chunks(Votes.objects.filter(position_id=position_id), progress, chunk_size)
+    _delete_in_chunks(Ranking.objects.filter(position_id=position_id), progress, chunk_size)
+    position.delete()
+
+
+def _delete_candidate(candidate_id, progress, chunk_size):
+    candidate = Candidate.objects.get(id=candidate_id)
+    _delete_in_chunks(Votes.objects.filter(candidate_id=candidate_id), progress, chunk_size)
+    candidate.delete()
+
+
+def _delete_voter(voter_id, progress, chunk_size):
+    # A voter has at most one vote per candidate, so there is nothing worth
+    # chunking; the pre_delete signal takes the votes off the tallies.
+    Voter.objects.select_related('admin').get(id=voter_id).admin.delete()
+
+
+DELETERS = {
+    'position': (_delete_position, lambda pk: (
+        Votes.objects.filter(position_id=pk).count() + Ranking.objects.filter(position_id=pk).count())),
+    'candidate': (_delete_candidate, lambda pk: Votes.objects.filter(candidate_id=pk).count()),
+    'voter': (_delete_voter, lambda pk: 0),
+}
+
+
+def run_delete(job_id, kind, pk, chunk_size=DELETE_CHUNK_SIZE):
+    delete, count = DELETERS[kind]
+    job = {'kind': kind, 'id': pk, 'done': 0, 'total': count(pk), 'finished': False, 'error': ''}
+    _save_job(job_id, job)
+
+    def progress(removed):
+        job['done'] += removed
+        _save_job(job_id, job)
+
+    try:
+        delete(pk, progress, chunk_size)
+    except (Position.DoesNotExist, Candidate.DoesNotExist, Voter.DoesNotExist):
+        job['error'] = f"This {kind} no longer exists"
+    except Exception as e:
+        job['error'] = str(e)
+    finally:
+        job['finished'] = True
+        _save_job(job_id, job)
+
+
+def _run_in_thread(*args):
+    try:
+        run_delete(*args)
+    finally:
+        # No request cycle closes the thread's own connection
+        connection.close()
+
+
+def start_delete(kind, pk):
+    """Delete the `kind` ('position', 'candidate' or 'voter') with id `pk` in a background thread"""
+    if kind not in DELETERS:
+        raise ValueError(f"Unknown kind {kind!r}")
+    job_id = uuid.uuid4().hex
+    _save_job(job_id, {'kind': kind, 'id': pk, 'done': 0, 'total': None, 'finished': False, 'error': ''})
+    threading.Thread(target=_run_in_thread, args=(job_id, kind, pk), daemon=True).start()
+    return job_id
@@ -0,0 +1,98 @@
+"""
+Streaming exports of the votes and the results, as CSV or NDJSON.
+
+Votes are read over both storages with values_list(...).iterator(), so no
+model instances are built and memory stays flat however many votes there
+are. Output is produced in batches of lines, and the CSV header goes out
+before the first query is even run.
+"""
+import csv
+import io
+import json
+from itertools import islice
+
+from .models import Ballot, Candidate, Votes
+from .storage import unpack_ids
+from .stv import tally_ranked_positions
+from .tally import tally_positions
+from .votes import results_by_position
+
+EXPORT_CHUNK_SIZE = 5000
+VOTE_COLUMNS = ('voter_id', 'last_name', 'first_name', 'position_id', 'position', 'candidate_id', 'candidate')
+RESULT_COLUMNS = ('position_id', 'position', 'candidate_id', 'candidate', 'votes', 'elected')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def vote_rows(chunk_size=EXPORT_CHUNK_SIZE):
+    """Every vote cast, as tuples of VOTE_COLUMNS: Votes rows first, then ballots"""
+    yield from (
+        Votes.objects.order_by('id')
+        .values_list('voter_id', 'voter__admin__last_name', 'voter__admin__first_name',
+                     'position_id', 'position__name', 'candidate_id', 'candidate__fullname')
+        .iterator(chunk_size=chunk_size)
+    )
+    candidates = {
+        candidate_id: (position_id, position, candidate_id, fullname)
+        for candidate_id, position_id, position, fullname in Candidate.objects.values_list(
+            'id', 'position_id', 'position__name', 'fullname')
+    }
+    ballots = (
+        Ballot.objects.order_by('id')
+        .values_list('voter_id', 'voter__admin__last_name', 'voter__admin__first_name', 'candidates')
+        .iterator(chunk_size=chunk_size)
+    )
+    for voter_id, last_name, first_name, blob in ballots:
+        for candidate_id in unpack_ids(blob):
+            candidate = candidates.get(candidate_id)
+            if candidate is not None:
+                yield (voter_id, last_name, first_name) + candidate
+
+
+def result_rows():
+    """Every candidate's total (paper counts included) and whether they are elected"""
+    for position in tally_ranked_positions(tally_positions(results_by_position())):
+        for candidate in position['candidates']:
+            yield (position['id'], position['name'], candidate['id'], candidate['name'],
+                   candidate['votes'], candidate['elected'])
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def csv_lines(columns, rows, batch_size=EXPORT_CHUNK_SIZE):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    yield out.getvalue()
+    for batch in _batches(rows, batch_size):
+        out.seek(0)
+        out.truncate()
+        writer.writerows(batch)
+        yield out.getvalue()
+
+
+def ndjson_lines(columns, rows, batch_size=EXPORT_CHUNK_SIZE):
+    # One object per line, keyed by column
+    for batch in _batches(rows, batch_size):
+        yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in batch)
+
+
+def export(kind, fmt, chunk_size=EXPORT_CHUNK_SIZE):
+    """The `kind` ('votes' or 'results') export in `fmt` ('csv' or 'ndjson'), as a generator of str"""
+    if kind == 'votes':
+        columns, rows = VOTE_COLUMNS, vote_rows(chunk_size)
+    elif kind == 'results':
+        columns, rows = RESULT_COLUMNS, result_rows()
+    else:
+        raise ValueError(f"Unknown export {kind!r}")
+    if fmt == 'csv':
+        return csv_lines(columns, rows, chunk_size)
+    if fmt == 'ndjson':
+        return ndjson_lines(columns, rows, chunk_size)
+    raise ValueError(f"Unknown format {fmt!r}")
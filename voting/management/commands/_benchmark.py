@@ -0,0 +1,46 @@
+"""
+Throwaway election data for the benchmark_* commands.
+
+Everything created here is tagged with a prefix and removed again by
+cleanup(), so the benchmarks can be pointed at a development database.
+"""
+from account.models import CustomUser
+from voting.ballot import bump_ballot_version
+from voting.models import Position, Candidate, Voter
+
+PREFIX = "bench-"
+
+
+def create_election(num_positions, candidates_per_position=3, max_vote=1):
+    Position.objects.bulk_create([
+        Position(name=f"{PREFIX}position-{i}", max_vote=max_vote, priority=0)
+        for i in range(num_positions)
+    ])
+    positions = list(Position.objects.filter(name__startswith=PREFIX).order_by('id'))
+    Candidate.objects.bulk_create([
+        Candidate(fullname=f"{PREFIX}candidate-{p.id}-{j}", bio="-",
+                  photo="candidates/benchmark.jpg", position=p)
+        for p in positions
+        for j in range(candidates_per_position)
+    ])
+    # bulk_create sends no signals
+    bump_ballot_version()
+    return positions
+
+
+def create_voters(count, offset=0):
+    CustomUser.objects.bulk_create([
+        CustomUser(email=f"{PREFIX}{offset + i}@example.com", password="!",
+                   first_name="Bench", last_name=str(offset + i))
+        for i in range(count)
+    ], batch_size=500)
+    users = CustomUser.objects.filter(email__startswith=PREFIX, voter__isnull=True).order_by('id')
+    Voter.objects.bulk_create([
+        Voter(admin=user, phone=f"9{user.id:010d}") for user in users
+    ], batch_size=500)
+    return list(Voter.objects.filter(admin__email__startswith=PREFIX).order_by('id'))
+
+
+def cleanup():
+    Position.objects.filter(name__startswith=PREFIX).delete()
+    CustomUser.objects.filter(email__startswith=PREFIX).delete()
@@ -0,0 +1,26 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from voting.archive import write_archive
+
+
+class Command(BaseCommand):
+    help = 'Snapshot positions, candidates, tallies and every vote into a compact archive file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?',
+                            help='Archive to write (default: election-<date>.evarchive)')
+
+    def handle(self, *args, **options):
+        path = options['path'] or f"election-{timezone.now():%Y%m%d-%H%M%S}.evarchive"
+        start = time.perf_counter()
+        manifest = write_archive(path)
+        tables = manifest['tables']
+        self.stdout.write(
+            f"{tables['positions']['rows']} positions, {tables['candidates']['rows']} candidates, "
+            f"{tables['votes']['rows']} votes, {tables['rankings']['rows']} rankings")
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {path} ({os.path.getsize(path) / 1024:.0f} KB) in {time.perf_counter() - start:.2f} s"))
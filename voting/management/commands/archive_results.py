@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.html import strip_tags
+
+from voting.archive import ElectionArchive, InvalidArchive
+from voting.tally import describe_outcome
+
+
+class Command(BaseCommand):
+    help = 'Show the results and turnout stored in an election archive (the database is not used)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+
+    def handle(self, *args, **options):
+        try:
+            archive = ElectionArchive(options['path'])
+        except (OSError, InvalidArchive) as e:
+            raise CommandError(e)
+        with archive:
+            self.stdout.write(f"{archive.manifest['title']} (archived {archive.manifest['created_at']})")
+            turnout = archive.turnout()
+            for position in archive.results():
+                voters = turnout['positions'].get(position['id'], 0)
+                self.stdout.write(f"{position['name']} ({voters} voters): "
+                                  + strip_tags(describe_outcome(position)).replace('&nbsp;', ''))
+                for candidate in position['candidates']:
+                    self.stdout.write(f"    {candidate['name']}: {candidate['votes']}")
+            self.stdout.write(
+                f"Turnout: {turnout['voted']} of {turnout['voters']} voters ({turnout['turnout']:.1%})"
+                + (f", {turnout['paper_ballots']} paper ballots" if turnout['paper_ballots'] else ""))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from voting.ballot import get_ballot_html, render_ballot
+
+from . import _benchmark
+
+
+class Command(BaseCommand):
+    help = 'Time rendering the ballot for many voters, with and without candidate rotation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, default=10000)
+        parser.add_argument('--positions', type=int, default=7)
+        parser.add_argument('--candidates', type=int, default=3,
+                            help='Candidates per position (default 3)')
+
+    def run(self, label, render, voters):
+        start = time.perf_counter()
+        for voter_id in range(1, voters + 1):
+            render(voter_id)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{label:<28} {elapsed:7.3f} s total  {elapsed * 1e6 / voters:9.1f} us/voter"
+        )
+
+    def handle(self, *args, **options):
+        voters = options['voters']
+        try:
+            _benchmark.cleanup()
+            _benchmark.create_election(options['positions'], options['candidates'])
+            get_ballot_html()  # warm the cache
+
+            self.run("cached, unrotated", lambda voter_id: get_ballot_html(), voters)
+            self.run("cached fragments, rotated", get_ballot_html, voters)
+            self.run("fresh render per voter", lambda voter_id: render_ballot().html(voter_id), voters)
+        finally:
+            _benchmark.cleanup()
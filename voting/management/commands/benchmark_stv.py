@@ -0,0 +1,53 @@
+import random
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from voting.storage import pack_ids, unpack_ids
+from voting.stv import stv_grouped
+
+
+class Command(BaseCommand):
+    help = 'Time the ranked-choice count on synthetic rankings (no database access)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ballots', type=int, default=1000000)
+        parser.add_argument('--candidates', type=int, default=12)
+        parser.add_argument('--seats', type=int, default=3)
+        parser.add_argument('--depth', type=int, default=5,
+                            help='Most candidates ranked on one ballot (default 5)')
+
+    def timed(self, label, func):
+        start = time.perf_counter()
+        result = func()
+        self.stdout.write(f"{label:<24} {time.perf_counter() - start:8.3f} s")
+        return result
+
+    def handle(self, *args, **options):
+        num_ballots, num_candidates = options['ballots'], options['candidates']
+        rng = random.Random(0)
+        candidates = list(range(1, num_candidates + 1))
+        # Skewed popularity, so rankings repeat the way real ones do
+        popularity = [1 / c for c in candidates]
+
+        def ranking():
+            chosen = []
+            for _ in range(rng.randint(1, options['depth'])):
+                c = rng.choices(candidates, popularity)[0]
+                if c not in chosen:
+                    chosen.append(c)
+            return pack_ids(chosen)
+
+        self.stdout.write(
+            f"{num_ballots} ballots, {num_candidates} candidates, {options['seats']} seats")
+        blobs = [ranking() for _ in range(num_ballots)]
+
+        # What storage.ranking_groups does with the rows it reads
+        packed = self.timed("group packed rankings", lambda: Counter(blobs))
+        groups = self.timed("unpack distinct", lambda: {
+            tuple(unpack_ids(blob)): count for blob, count in packed.items()})
+        result = self.timed("count", lambda: stv_grouped(groups, options['seats'], candidates))
+        self.stdout.write(
+            f"{len(groups)} distinct rankings, {len(result['rounds'])} rounds, "
+            f"elected {result['elected']}")
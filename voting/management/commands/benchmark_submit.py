@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from voting.ballot import get_ballot_schema
+from voting.models import Votes
+from voting.votes import record_ballot
+
+from . import _benchmark
+
+
+def record_ballot_per_row(voter, selections):
+    """The previous submit_ballot write path: one autocommitted INSERT per vote"""
+    for position_id, candidate_ids in selections.items():
+        for candidate_id in candidate_ids:
+            Votes.objects.create(voter=voter, position_id=position_id, candidate_id=candidate_id)
+    voter.voted = True
+    voter.save()
+
+
+class Command(BaseCommand):
+    help = 'Compare per-vote inserts with the single-transaction ballot write'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ballots', type=int, default=200,
+                            help='Ballots submitted per run (default 200)')
+        parser.add_argument('--positions', type=int, nargs='+', default=[7, 50],
+                            help='Ballot sizes to compare (default 7 50)')
+
+    def handle(self, *args, **options):
+        ballots = options['ballots']
+        try:
+            for num_positions in options['positions']:
+                _benchmark.cleanup()
+                positions = _benchmark.create_election(num_positions)
+                schema = get_ballot_schema()
+                # Every voter picks the first candidate of each position
+                first = {}
+                for candidate_id, position_id in sorted(schema.candidate_position.items()):
+                    first.setdefault(position_id, [candidate_id])
+                selections = {p.id: first[p.id] for p in positions}
+
+                voters = _benchmark.create_voters(ballots * 2)
+                for label, write, batch in (
+                    ("per-vote", record_ballot_per_row, voters[:ballots]),
+                    ("atomic bulk", record_ballot, voters[ballots:]),
+                ):
+                    start = time.perf_counter()
+                    for voter in batch:
+                        write(voter, selections)
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(
+                        f"{num_positions:>3} positions  {label:<12} "
+                        f"{elapsed * 1000 / ballots:8.2f} ms/ballot"
+                    )
+        finally:
+            _benchmark.cleanup()
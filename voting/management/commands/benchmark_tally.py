@@ -0,0 +1,57 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from voting import tally
+
+
+def find_n_winners(data, n):
+    """The winner selection PrintView used before voting/tally.py"""
+    final_list = []
+    candidate_data = data[:]
+    for i in range(0, n):
+        if len(candidate_data) == 0:
+            continue
+        this_winner = max(candidate_data, key=lambda x: x['votes'])
+        final_list.append(this_winner['name'] + " with " + str(this_winner['votes']) + " votes")
+        candidate_data.remove(this_winner)
+    return ", &nbsp;".join(final_list)
+
+
+class Command(BaseCommand):
+    help = 'Time the tally engine on synthetic results (no database access)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--positions', type=int, default=10000)
+        parser.add_argument('--candidates', type=int, default=100,
+                            help='Candidates per position (default 100)')
+        parser.add_argument('--seats', type=int, default=3,
+                            help='Winners per position (default 3)')
+
+    def timed(self, label, func):
+        start = time.perf_counter()
+        func()
+        self.stdout.write(f"{label:<24} {time.perf_counter() - start:8.3f} s")
+
+    def handle(self, *args, **options):
+        num_positions, per_position, seats = options['positions'], options['candidates'], options['seats']
+        rng = random.Random(0)
+        position = [p for p in range(num_positions) for _ in range(per_position)]
+        votes = [rng.randint(0, 1000) for _ in position]
+        seat_list = [seats] * num_positions
+        self.stdout.write(f"{num_positions} positions x {per_position} candidates, {seats} seats")
+
+        def previous():
+            for p in range(num_positions):
+                data = [
+                    {'name': str(i), 'votes': votes[i]}
+                    for i in range(p * per_position, (p + 1) * per_position)
+                ]
+                find_n_winners(data, seats)
+
+        self.timed("find_n_winners", previous)
+        self.timed("engine (python)", lambda: tally._tally_python(position, votes, seat_list))
+        if tally.np is not None:
+            arrays = tally.np.asarray(position), tally.np.asarray(votes), tally.np.asarray(seat_list)
+            self.timed("engine (numpy)", lambda: tally._tally_numpy(*arrays))
@@ -0,0 +1,59 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from django.test import override_settings
+
+from voting.models import Candidate
+from voting.votes import create_tallies, record_ballot
+
+from . import _benchmark
+
+
+class Command(BaseCommand):
+    help = 'Submit ballots from many threads for a single-candidate position, with 1 and K tally shards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--ballots', type=int, default=800)
+        parser.add_argument('--shards', type=int, default=8,
+                            help='K, compared against a single shard (default 8)')
+
+    def submit(self, voters, selections):
+        errors = 0
+        try:
+            for voter in voters:
+                try:
+                    record_ballot(voter, selections)
+                except DatabaseError:
+                    errors += 1
+        finally:
+            connection.close()
+        return errors
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        try:
+            for shards in (1, options['shards']):
+                _benchmark.cleanup()
+                with override_settings(VOTE_TALLY_SHARDS=shards):
+                    position = _benchmark.create_election(1, candidates_per_position=1)[0]
+                    candidate = Candidate.objects.get(position=position)
+                    create_tallies([candidate.id])
+                    selections = {position.id: [candidate.id]}
+                    voters = _benchmark.create_voters(options['ballots'])
+
+                    start = time.perf_counter()
+                    with ThreadPoolExecutor(max_workers=threads) as pool:
+                        errors = sum(pool.map(
+                            lambda i: self.submit(voters[i::threads], selections),
+                            range(threads)
+                        ))
+                    elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"{shards:>3} shard(s)  {threads} threads  "
+                    f"{(len(voters) - errors) / elapsed:8.1f} ballots/s  {errors} failed"
+                )
+        finally:
+            _benchmark.cleanup()
@@ -0,0 +1,30 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from voting.export import EXPORT_CHUNK_SIZE, export
+
+
+class Command(BaseCommand):
+    help = 'Stream every vote (or, with --results, the results) as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=('csv', 'ndjson'), default='csv')
+        parser.add_argument('--results', action='store_const', const='results', default='votes',
+                            dest='kind', help='Export the results per candidate instead of the votes')
+        parser.add_argument('--output', '-o', help='File to write (default: standard output)')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+                            help=f'Rows fetched and written at a time (default {EXPORT_CHUNK_SIZE})')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        out = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for chunk in export(options['kind'], options['format'], options['chunk_size']):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        if options['output']:
+            self.stderr.write(f"Wrote {options['output']} in {time.perf_counter() - start:.2f} s")
@@ -0,0 +1,213 @@
+"""
+Import positions and candidates from a manifest and a zip of photos.
+
+The manifest is either JSON, in the shape populate_candidates uses:
+
+    [{"position": "President", "max_vote": 1, "ranked": false,
+      "candidates": [{"fullname": "...", "bio": "...", "photo": "president/a.jpg"}]}]
+
+or CSV with one candidate per row and the columns position, fullname,
+bio and photo (and optionally max_vote and ranked). Photos are paths
+inside the zip.
+
+Positions are matched by name and candidates by position and full name,
+then created or updated in bulk, in one transaction. Each candidate keeps
+a hash of its row and of the photo's CRC in the zip. A re-run skips the
+candidates whose hash has not changed, without extracting their photos.
+The photos that are needed are checked and saved by a thread pool before
+anything is written.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from voting.ballot import bump_ballot_version, renumber_positions
+from voting.models import Candidate, Position
+from voting.votes import create_tallies
+
+WORKERS = 8
+
+
+def _max_length(model, field):
+    return model._meta.get_field(field).max_length
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def read_manifest(path):
+    """The manifest as a list of candidate rows, each naming its position"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if path.lower().endswith('.json'):
+            rows = []
+            for position in json.load(f):
+                for candidate in position.get('candidates', []):
+                    rows.append(dict(
+                        candidate, position=position.get('position', ''),
+                        max_vote=position.get('max_vote'), ranked=position.get('ranked')))
+            return rows
+        return list(csv.DictReader(f))
+
+
+class Command(BaseCommand):
+    help = 'Import positions and candidates from a JSON or CSV manifest and a zip of photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest')
+        parser.add_argument('photos', help='Zip archive with the photos named in the manifest')
+        parser.add_argument('--workers', type=int, default=WORKERS,
+                            help=f'Threads checking and saving photos (default {WORKERS})')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            rows = read_manifest(options['manifest'])
+            archive = zipfile.ZipFile(options['photos'])
+        except (OSError, ValueError, AttributeError, zipfile.BadZipFile) as e:
+            raise CommandError(f"Cannot read the manifest or the photos: {e}")
+
+        with archive:
+            rows = self.clean(rows, archive)
+            created, updated, unchanged = self.plan(rows)
+            # Photos first: a bad one stops the import before anything is written
+            self.save_photos(archive, created + updated, options['workers'])
+
+        with transaction.atomic():
+            positions, positions_changed = self.upsert_positions(rows)
+            for candidate, row in created:
+                candidate.position = positions[row['position']]
+            Candidate.objects.bulk_create([candidate for candidate, row in created])
+            Candidate.objects.bulk_update(
+                [candidate for candidate, row in updated], ['bio', 'photo', 'import_hash'])
+            new_ids = [candidate.pk for candidate, row in created]
+            if None in new_ids:
+                # The backend cannot return the ids of bulk inserted rows
+                new_ids = list(Candidate.objects.filter(
+                    import_hash__in=[candidate.import_hash for candidate, row in created],
+                ).values_list('id', flat=True))
+            # bulk_create and bulk_update send no signals
+            create_tallies(new_ids)
+            if positions_changed or created or updated:
+                transaction.on_commit(bump_ballot_version)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(created)} candidates created, {len(updated)} updated, {unchanged} unchanged "
+            f"in {time.perf_counter() - start:.2f} s"))
+
+    def clean(self, rows, archive):
+        """Normalised rows, or a CommandError listing every problem in the manifest"""
+        photos = {info.filename: info for info in archive.infolist() if not info.is_dir()}
+        errors, cleaned, seen = [], [], set()
+        for num, row in enumerate(rows, start=1):
+            row = {key: str(value).strip() if value is not None else '' for key, value in row.items()}
+            for column in ('position', 'fullname', 'bio', 'photo'):
+                if not row.get(column):
+                    errors.append(f"Row {num}: missing {column}")
+                    break
+            else:
+                if len(row['position']) > _max_length(Position, 'name'):
+                    errors.append(f"Row {num}: position name is too long")
+                elif len(row['fullname']) > _max_length(Candidate, 'fullname'):
+                    errors.append(f"Row {num}: fullname is too long")
+                elif row['photo'] not in photos:
+                    errors.append(f"Row {num}: {row['photo']} is not in the archive")
+                elif (row['position'], row['fullname']) in seen:
+                    errors.append(f"Row {num}: {row['fullname']} is listed twice for {row['position']}")
+                elif not (row.get('max_vote') or '1').isdigit() or int(row.get('max_vote') or 1) < 1:
+                    errors.append(f"Row {num}: invalid max_vote")
+                else:
+                    seen.add((row['position'], row['fullname']))
+                    row['max_vote'] = int(row.get('max_vote') or 1)
+                    row['ranked'] = _flag(row.get('ranked'))
+                    row['photo'] = photos[row['photo']]
+                    cleaned.append(row)
+        if errors:
+            raise CommandError("Nothing was imported:\n" + "\n".join(errors))
+        return cleaned
+
+    def plan(self, rows):
+        """([(new candidate, row)], [(changed candidate, row)], number unchanged)"""
+        existing = {
+            (candidate.position.name, candidate.fullname): candidate
+            for candidate in Candidate.objects.select_related('position').filter(
+                position__name__in={row['position'] for row in rows})
+        }
+        created, updated, unchanged = [], [], 0
+        for row in rows:
+            # The CRC and size stand in for the photo, so unchanged rows
+            # never need it extracted
+            digest = hashlib.sha256(json.dumps([
+                row['position'], row['fullname'], row['bio'], row['photo'].CRC, row['photo'].file_size,
+            ]).encode()).hexdigest()
+            candidate = existing.get((row['position'], row['fullname']))
+            if candidate is None:
+                candidate = Candidate(fullname=row['fullname'])
+                created.append((candidate, row))
+            elif candidate.import_hash == digest:
+                unchanged += 1
+                continue
+            else:
+                updated.append((candidate, row))
+            candidate.bio, candidate.import_hash = row['bio'], digest
+        return created, updated, unchanged
+
+    def save_photos(self, archive, changed, workers):
+        with ThreadPoolExecutor(workers) as pool:
+            results = list(pool.map(lambda item: self.save_photo(archive, *item), changed))
+        errors = [error for stored, error in results if error]
+        if errors:
+            for stored, error in results:
+                if stored:
+                    Candidate.photo.field.storage.delete(stored)
+            raise CommandError("Nothing was imported:\n" + "\n".join(errors))
+
+    @staticmethod
+    def save_photo(archive, candidate, row):
+        """Check the row's photo and store it for `candidate`: (stored name, None) or (None, error)"""
+        info = row['photo']
+        try:
+            data = archive.read(info)
+            Image.open(io.BytesIO(data)).verify()
+        except Exception as e:
+            return None, f"{info.filename}: not a usable image ({e})"
+        candidate.photo.save(os.path.basename(info.filename), ContentFile(data), save=False)
+        return candidate.photo.name, None
+
+    def upsert_positions(self, rows):
+        """{name: position} for the manifest's positions, and whether any was created or changed"""
+        wanted = {}
+        for row in rows:
+            wanted.setdefault(row['position'], (row['max_vote'], row['ranked']))
+        positions = Position.objects.in_bulk(list(wanted), field_name='name')
+        changed = []
+        for name, position in positions.items():
+            if (position.max_vote, position.ranked) != wanted[name]:
+                position.max_vote, position.ranked = wanted[name]
+                changed.append(position)
+        # New positions go to the end of the ballot, in manifest order
+        last = max(Position.objects.values_list('priority', flat=True), default=0)
+        new = [
+            Position(name=name, max_vote=max_vote, ranked=ranked, priority=last + num)
+            for num, (name, (max_vote, ranked)) in enumerate(
+                ((name, spec) for name, spec in wanted.items() if name not in positions), start=1)
+        ]
+        Position.objects.bulk_create(new)
+        Position.objects.bulk_update(changed, ['max_vote', 'ranked'])
+        if new:
+            renumber_positions()
+        if new or changed:
+            self.stdout.write(f"{len(new)} positions created, {len(changed)} updated")
+        return Position.objects.in_bulk(list(wanted), field_name='name'), bool(new or changed)
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from voting.paper import InvalidPaperImport, import_paper
+
+
+class Command(BaseCommand):
+    help = 'Import paper ballots (one line per ballot) or per-station counts from CSV files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_files', nargs='+')
+
+    def handle(self, *args, **options):
+        lines = 0
+        start = time.perf_counter()
+        for path in options['csv_files']:
+            try:
+                with open(path, newline='', encoding='utf-8-sig') as f:
+                    results = import_paper(f)
+            except (OSError, InvalidPaperImport) as e:
+                raise CommandError(f"{path}: {e}")
+            for code, (station, outcome) in results.items():
+                lines += station.lines
+                detail = f" ({station.ballots} ballots, {station.spoilt} spoilt)" if station.ballots else ""
+                style = self.style.SUCCESS if outcome == 'imported' else self.style.WARNING
+                self.stdout.write(style(f"{code}: {outcome}{detail}"))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{lines} lines in {elapsed:.2f} s ({lines / elapsed * 60:.0f} lines/min)")
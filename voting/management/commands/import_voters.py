@@ -0,0 +1,204 @@
+"""
+Import a voters roll from a CSV file with the columns last_name,
+first_name, email, phone and password.
+
+Rows are read a batch at a time. Emails and phones are checked against the
+database with one query each per batch (and against the earlier rows of
+the file). Passwords are hashed across a process pool, which is where
+nearly all the time goes. While the pool hashes one batch, the previous
+one is inserted with bulk_create. Rows that cannot be imported are
+written, with the reason, to a rejects file next to the input.
+"""
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from account.models import CustomUser
+from voting.models import Voter
+from voting.voter_index import invalidate_index
+
+COLUMNS = ('last_name', 'first_name', 'email', 'phone', 'password')
+BATCH_SIZE = 1000
+
+
+def _max_length(model, field):
+    return model._meta.get_field(field).max_length
+
+
+MAX_LENGTHS = {
+    'last_name': _max_length(CustomUser, 'last_name'),
+    'first_name': _max_length(CustomUser, 'first_name'),
+    'email': _max_length(CustomUser, 'email'),
+    'phone': _max_length(Voter, 'phone'),
+}
+
+
+def row_error(row):
+    """Why `row` (with its email lowercased) cannot be imported, or None"""
+    for column in COLUMNS:
+        if not row[column]:
+            return f"Missing {column}"
+    for column, max_length in MAX_LENGTHS.items():
+        if len(row[column]) > max_length:
+            return f"{column} is longer than {max_length} characters"
+    try:
+        validate_email(row['email'])
+    except ValidationError:
+        return "Invalid email"
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Import voters from a CSV file (last_name, first_name, email, phone, password)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file')
+        parser.add_argument('--rejects',
+                            help='Where to write rejected rows (default: <csv_file>.rejects.csv)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help=f'Rows checked and inserted together (default {BATCH_SIZE})')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Processes hashing passwords (default: one per CPU; 1 hashes inline)')
+
+    def handle(self, *args, **options):
+        path, batch_size, workers = options['csv_file'], options['batch_size'], options['workers']
+        self.rejects_path = options['rejects'] or os.path.splitext(path)[0] + '.rejects.csv'
+        self.rejects = None
+        self.imported = self.rejected = 0
+        self.seen_emails, self.seen_phones = set(), set()
+        self.start = time.perf_counter()
+
+        try:
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                reader = csv.DictReader(f)
+                missing = [column for column in COLUMNS if column not in (reader.fieldnames or ())]
+                if missing:
+                    raise CommandError(f"{path} has no {', '.join(missing)} column")
+                self.fieldnames = reader.fieldnames
+                # Children forked or spawned for the pool need the settings
+                # to pick the hasher
+                pool = ProcessPoolExecutor(workers, initializer=django.setup) if workers > 1 else None
+                try:
+                    self.run(reader, batch_size, pool, workers)
+                finally:
+                    if pool is not None:
+                        pool.shutdown()
+        except OSError as e:
+            raise CommandError(e)
+        finally:
+            if self.rejects is not None:
+                self.rejects[0].close()
+
+        if self.imported:
+            # bulk_create sends no signals
+            invalidate_index()
+        elapsed = time.perf_counter() - self.start
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.imported} voters in {elapsed:.1f} s "
+            f"({self.imported / elapsed:.0f} voters/s), rejected {self.rejected}"))
+        if self.rejected:
+            self.stdout.write(f"Rejected rows written to {self.rejects_path}")
+
+    def run(self, reader, batch_size, pool, workers):
+        pending = None
+        for batch in iter(lambda: list(islice(reader, batch_size)), []):
+            rows = self.check_batch(batch)
+            if not rows:
+                continue
+            passwords = [row['password'] for row in rows]
+            if pool is None:
+                hashed = map(make_password, passwords)
+            else:
+                hashed = pool.map(make_password, passwords,
+                                  chunksize=max(1, len(passwords) // (workers * 4)))
+            # This batch hashes in the pool while the previous one is inserted
+            if pending is not None:
+                self.insert(*pending)
+            pending = rows, hashed
+        if pending is not None:
+            self.insert(*pending)
+
+    def check_batch(self, batch):
+        """The rows of `batch` that can be imported; the others are rejected"""
+        rows = []
+        for row in batch:
+            row = {column: (row.get(column) or '').strip() for column in self.fieldnames}
+            row['email'] = row['email'].lower()
+            error = row_error(row)
+            if error is None and row['email'] in self.seen_emails:
+                error = "Email repeated in this file"
+            if error is None and row['phone'] in self.seen_phones:
+                error = "Phone repeated in this file"
+            if error is not None:
+                self.reject(row, error)
+                continue
+            self.seen_emails.add(row['email'])
+            self.seen_phones.add(row['phone'])
+            rows.append(row)
+        return self.check_database(rows)
+
+    def check_database(self, rows):
+        emails = set(CustomUser.objects.filter(
+            email__in=[row['email'] for row in rows]).values_list('email', flat=True))
+        phones = set(Voter.objects.filter(
+            phone__in=[row['phone'] for row in rows]).values_list('phone', flat=True))
+        accepted = []
+        for row in rows:
+            if row['email'] in emails:
+                self.reject(row, "The given email is already registered")
+            elif row['phone'] in phones:
+                self.reject(row, "The given phone is already registered")
+            else:
+                accepted.append(row)
+        return accepted
+
+    def insert(self, rows, hashed):
+        hashed = list(hashed)
+        try:
+            self.create(rows, hashed)
+        except IntegrityError:
+            # Someone registered one of these since the batch was checked
+            by_email = dict(zip((row['email'] for row in rows), hashed))
+            rows = self.check_database(rows)
+            hashed = [by_email[row['email']] for row in rows]
+            self.create(rows, hashed)
+        self.imported += len(rows)
+        elapsed = time.perf_counter() - self.start
+        self.stdout.write(
+            f"{self.imported} imported, {self.rejected} rejected ({self.imported / elapsed:.0f} voters/s)")
+
+    def create(self, rows, hashed):
+        users = [
+            CustomUser(email=row['email'], first_name=row['first_name'],
+                       last_name=row['last_name'], password=password)
+            for row, password in zip(rows, hashed)
+        ]
+        with transaction.atomic():
+            CustomUser.objects.bulk_create(users)
+            if users and users[0].pk is None:
+                # The backend cannot return the ids of bulk inserted rows
+                ids = dict(CustomUser.objects.filter(
+                    email__in=[user.email for user in users]).values_list('email', 'id'))
+                for user in users:
+                    user.pk = ids[user.email]
+            Voter.objects.bulk_create([
+                Voter(admin=user, phone=row['phone']) for user, row in zip(users, rows)
+            ])
+
+    def reject(self, row, error):
+        if self.rejects is None:
+            f = open(self.rejects_path, 'w', newline='', encoding='utf-8')
+            writer = csv.DictWriter(f, list(self.fieldnames) + ['error'], extrasaction='ignore')
+            writer.writeheader()
+            self.rejects = f, writer
+        self.rejects[1].writerow(dict(row, error=error))
+        self.rejected += 1
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from voting.votes import rebuild_tallies
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-candidate vote tallies from the Votes table'
+
+    def handle(self, *args, **kwargs):
+        total = rebuild_tallies()
+        self.stdout.write(self.style.SUCCESS(f"Tallies rebuilt from {total} votes"))
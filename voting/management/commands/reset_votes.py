@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from voting.votes import RESET_CHUNK_SIZE, reset_election
+
+
+class Command(BaseCommand):
+    help = 'Remove every vote and let all voters vote again, in short chunked deletes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Do not ask for confirmation')
+        parser.add_argument('--chunk-size', type=int, default=RESET_CHUNK_SIZE,
+                            help=f'Rows deleted per transaction (default {RESET_CHUNK_SIZE})')
+
+    def progress(self, label, removed, total):
+        self.stdout.write(f"{label}: {removed}/{total} ({removed * 100 // total}%)")
+
+    def handle(self, *args, **options):
+        if options['interactive']:
+            answer = input("This deletes every vote of the election. Type 'yes' to continue: ")
+            if answer != 'yes':
+                raise CommandError("Reset cancelled")
+
+        start = time.perf_counter()
+        removed = reset_election(self.progress, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {sum(removed.values())} rows in {time.perf_counter() - start:.2f} s"))
@@ -7,6 +7,8 @@ class Voter(models.Model):
     phone = models.CharField(max_length=11, unique=True)
     verified = models.BooleanField(default=True)
     voted = models.BooleanField(default=False)
+    # Idempotency key of the submission that claimed this voter's ballot
+    ballot_key = models.CharField(max_length=64, blank=True, default='')
 
     def __str__(self):
         return f"{self.admin.last_name}, {self.admin.first_name}"
@@ -17,6 +19,9 @@ class Position(models.Model):
     name = models.CharField(max_length=50, unique=True)
     max_vote = models.IntegerField()
     priority = models.IntegerField()
+    # Voters rank the candidates and max_vote seats are filled by STV (IRV
+    # for a single seat) instead of plurality; see voting/stv.py
+    ranked = models.BooleanField(default=False)
 
     def __str__(self):
         return self.name
@@ -27,6 +32,9 @@ class Candidate(models.Model):
     photo = models.ImageField(upload_to="candidates")
     bio = models.TextField()
     position = models.ForeignKey(Position, on_delete=models.CASCADE)
+    # Hash of the manifest row and photo this candidate was last imported
+    # from, so import_candidates can skip it when nothing changed
+    import_hash = models.CharField(max_length=64, blank=True, default='')
 
     def __str__(self):
         return self.fullname
@@ -36,3 +44,95 @@ class Votes(models.Model):
     voter = models.ForeignKey(Voter, on_delete=models.CASCADE)
     position = models.ForeignKey(Position, on_delete=models.CASCADE)
     candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['voter', 'position', 'candidate'], name='unique_vote'),
+        ]
+
+
+class Ballot(models.Model):
+    """
+    A whole ballot in one row: the chosen candidate ids packed as unsigned
+    32-bit little-endian integers. Used instead of one Votes row per
+    selection when VOTE_STORAGE is 'ballots'; see voting/storage.py.
+    """
+    voter = models.OneToOneField(Voter, on_delete=models.CASCADE)
+    candidates = models.BinaryField()
+
+    def __str__(self):
+        return str(self.voter)
+
+
+class Ranking(models.Model):
+    """
+    A voter's preference order for a ranked Position, packed like
+    Ballot.candidates with the first preference first. The first preference
+    is also recorded as an ordinary vote.
+    """
+    voter = models.ForeignKey(Voter, on_delete=models.CASCADE)
+    position = models.ForeignKey(Position, on_delete=models.CASCADE)
+    candidates = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['voter', 'position'], name='unique_ranking'),
+        ]
+
+    def __str__(self):
+        return f"{self.voter}: {self.position}"
+
+
+class Station(models.Model):
+    """
+    A polling station whose paper ballots were counted and imported (see
+    voting/paper.py). The code is the idempotency key: each station is
+    imported once.
+    """
+    code = models.CharField(max_length=50, unique=True)
+    # Unknown (null) when the station sent aggregate counts
+    ballots = models.PositiveIntegerField(null=True)
+    spoilt = models.PositiveIntegerField(default=0)
+    imported_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.code
+
+
+class PaperTally(models.Model):
+    """A candidate's votes on the paper ballots of one station"""
+    station = models.ForeignKey(Station, on_delete=models.CASCADE, related_name='tallies')
+    candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE)
+    votes = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['station', 'candidate'], name='unique_paper_tally'),
+        ]
+
+    def __str__(self):
+        return f"{self.station}: {self.candidate}: {self.votes}"
+
+
+class VoteTally(models.Model):
+    """
+    Running vote count per candidate, kept in step with Votes and the paper
+    counts (PaperTally).
+
+    Each candidate has VOTE_TALLY_SHARDS rows and a voter only ever touches
+    the shard picked by their id, so concurrent ballots for the same
+    candidate do not all update one row. A candidate's total is the sum of
+    its shards.
+    """
+    candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE, related_name='tallies')
+    shard = models.PositiveSmallIntegerField(default=0)
+    votes = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['candidate', 'shard'], name='unique_tally_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.candidate} [{self.shard}]: {self.votes}"
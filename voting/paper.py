@@ -0,0 +1,160 @@
+"""
+Importing the counts of polling stations that vote on paper.
+
+A file holds either one CSV line per ballot or aggregate counts:
+
+- per ballot: a 'station' column, then one column per position, named by
+  its form key (as in the ballot form), holding the ids of the marked
+  candidates separated by spaces or semicolons. Each line is checked with
+  the same BallotSchema as an online ballot, in memory; a ballot it
+  rejects is counted as spoilt.
+- aggregates: the columns station, candidate (id) and votes.
+
+Every station's counts are summed in memory and written in one short
+transaction: a Station row, whose unique code makes the import
+idempotent, its PaperTally rows and the same counts added to the
+candidates' VoteTally.
+
+Paper ballots carry no voter, so ranked positions, which are counted from
+each voter's Ranking, cannot be imported this way.
+"""
+import csv
+import re
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.datastructures import MultiValueDict
+
+from .ballot import InvalidBallot, get_ballot_schema
+from .models import PaperTally, Station, VoteTally
+from .votes import bump_vote_version, create_tallies
+
+SEPARATOR = re.compile(r'[\s;]+')
+CODE_MAX_LENGTH = Station._meta.get_field('code').max_length
+
+
+class InvalidPaperImport(Exception):
+    """The file as a whole cannot be imported"""
+
+
+class StationCount:
+    def __init__(self):
+        self.counts = Counter()  # candidate_id: votes
+        self.lines = 0
+        self.ballots = 0  # None for aggregate counts
+        self.spoilt = 0
+        self.errors = []
+
+
+def count_stations(lines, schema=None):
+    """{station code: StationCount} for the CSV `lines`"""
+    if schema is None:
+        schema = get_ballot_schema()
+    reader = csv.DictReader(lines)
+    fields = reader.fieldnames or []
+    if 'station' not in fields:
+        raise InvalidPaperImport("The file has no station column")
+    if 'candidate' in fields and 'votes' in fields:
+        count_row = _aggregate_counter(schema)
+    else:
+        count_row = _ballot_counter(schema, [field for field in fields if field != 'station'])
+
+    stations = {}
+    for row in reader:
+        code = (row.get('station') or '').strip()
+        if not code or len(code) > CODE_MAX_LENGTH:
+            raise InvalidPaperImport(f"Line {reader.line_num}: invalid station")
+        station = stations.get(code)
+        if station is None:
+            station = stations[code] = StationCount()
+        station.lines += 1
+        count_row(station, row, reader.line_num)
+    return stations
+
+
+def _ballot_counter(schema, columns):
+    unknown = [column for column in columns if column not in schema.form_keys]
+    if unknown:
+        raise InvalidPaperImport(f"Unknown positions: {', '.join(unknown)}")
+    ranked = [column for column in columns if schema.form_keys[column] in schema.ranked]
+    if ranked:
+        raise InvalidPaperImport(f"Ranked positions cannot be imported from paper: {', '.join(ranked)}")
+
+    def count_ballot(station, row, line_num):
+        station.ballots += 1
+        data = MultiValueDict({
+            column: SEPARATOR.split(value) if (value := (row[column] or '').strip()) else []
+            for column in columns
+        })
+        try:
+            selections = schema.clean(data)
+        except InvalidBallot:
+            station.spoilt += 1
+            return
+        for chosen in selections.values():
+            station.counts.update(chosen)
+    return count_ballot
+
+
+def _aggregate_counter(schema):
+    def count_aggregate(station, row, line_num):
+        station.ballots = None
+        try:
+            candidate_id, votes = int(row['candidate']), int(row['votes'])
+        except (TypeError, ValueError):
+            station.errors.append(f"Line {line_num}: invalid candidate or votes")
+            return
+        position_id = schema.candidate_position.get(candidate_id)
+        if position_id is None:
+            station.errors.append(f"Line {line_num}: unknown candidate {candidate_id}")
+        elif position_id in schema.ranked:
+            station.errors.append(f"Line {line_num}: ranked positions cannot be imported from paper")
+        elif votes < 0:
+            station.errors.append(f"Line {line_num}: invalid votes")
+        elif candidate_id in station.counts:
+            station.errors.append(f"Line {line_num}: candidate {candidate_id} is counted twice")
+        else:
+            station.counts[candidate_id] = votes
+    return count_aggregate
+
+
+def record_station(code, station):
+    """Write one station's counts; False if it had already been imported"""
+    counts = {candidate_id: votes for candidate_id, votes in station.counts.items() if votes}
+    try:
+        with transaction.atomic():
+            record = Station.objects.create(code=code, ballots=station.ballots, spoilt=station.spoilt)
+            PaperTally.objects.bulk_create([
+                PaperTally(station=record, candidate_id=candidate_id, votes=votes)
+                for candidate_id, votes in counts.items()
+            ])
+            create_tallies(list(counts))
+            for candidate_id, votes in counts.items():
+                VoteTally.objects.filter(candidate_id=candidate_id, shard=0).update(votes=F('votes') + votes)
+            transaction.on_commit(bump_vote_version)
+    except IntegrityError:
+        if Station.objects.filter(code=code).exists():
+            return False
+        raise
+    return True
+
+
+def import_paper(lines, schema=None):
+    """
+    Count and record every station in the CSV `lines`. Returns
+    {station code: (StationCount, outcome)}, the outcome being 'imported',
+    'already imported' or the errors that kept the station out.
+    """
+    stations = count_stations(lines, schema)
+    done = set(Station.objects.filter(code__in=list(stations)).values_list('code', flat=True))
+    results = {}
+    for code, station in stations.items():
+        if station.errors:
+            outcome = "; ".join(station.errors)
+        elif code in done or not record_station(code, station):
+            outcome = 'already imported'
+        else:
+            outcome = 'imported'
+        results[code] = (station, outcome)
+    return results
@@ -0,0 +1,49 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from account.models import CustomUser
+from .models import Position, Candidate, Voter
+from . import ballot, storage, voter_index, votes
+
+
+@receiver([post_save, post_delete], sender=Position)
+def position_changed(sender, instance, **kwargs):
+    ballot.renumber_positions()
+    # Only once committed: a request reading the new version before that
+    # would cache the old ballot under it
+    transaction.on_commit(ballot.bump_ballot_version)
+
+
+@receiver([post_save, post_delete], sender=Candidate)
+def candidate_changed(sender, instance, **kwargs):
+    transaction.on_commit(ballot.bump_ballot_version)
+
+
+@receiver(post_save, sender=Candidate)
+def create_candidate_tally(sender, instance, created, **kwargs):
+    if created:
+        votes.create_tallies([instance.id])
+
+
+@receiver(pre_delete, sender=Voter)
+def remove_voter_from_tallies(sender, instance, **kwargs):
+    # The voter's votes are about to be removed by the cascade
+    candidate_ids = storage.voter_candidate_ids(instance)
+    votes.add_to_tallies(candidate_ids, votes.shard_for(instance.id), amount=-1)
+
+
+@receiver([post_save, post_delete], sender=Voter)
+def voter_changed(sender, instance, **kwargs):
+    voter_id = instance.id
+    transaction.on_commit(lambda: voter_index.voter_changed(voter_id))
+
+
+@receiver(post_save, sender=CustomUser)
+def voter_user_changed(sender, instance, created, update_fields=None, **kwargs):
+    # Names and email live on the user; a new user has no voter yet, and a
+    # login only saves last_login
+    if created or (update_fields and not {'first_name', 'last_name', 'email'} & set(update_fields)):
+        return
+    for voter_id in Voter.objects.filter(admin=instance).values_list('id', flat=True):
+        transaction.on_commit(lambda voter_id=voter_id: voter_index.voter_changed(voter_id))
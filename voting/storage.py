@@ -0,0 +1,167 @@
+"""
+Vote storage.
+
+Votes are kept either as one Votes row per selection or, with VOTE_STORAGE
+set to 'ballots', as one Ballot row per voter holding packed candidate ids.
+The readers below look at both, so results, the admin votes list and
+exports do not depend on the storage in use (or on it being switched
+mid-election).
+"""
+import sys
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Count, Sum
+
+from .models import Ballot, Candidate, PaperTally, Ranking, Votes
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+BALLOT_CHUNK_SIZE = 5000
+
+
+def ballot_storage():
+    return getattr(settings, 'VOTE_STORAGE', 'rows') == 'ballots'
+
+
+def pack_ids(candidate_ids):
+    packed = array('I', candidate_ids)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_ids(blob):
+    ids = array('I')
+    ids.frombytes(bytes(blob))
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids.tolist()
+
+
+def count_packed(blobs):
+    """Count candidate ids over many packed ballots at once"""
+    data = b"".join(blobs)
+    if not data:
+        return Counter()
+    if np is not None:
+        ids, counts = np.unique(np.frombuffer(data, dtype='<u4'), return_counts=True)
+        return Counter(dict(zip(ids.tolist(), counts.tolist())))
+    return Counter(unpack_ids(data))
+
+
+def count_votes():
+    """{candidate_id: votes} over both storages and the paper counts"""
+    counts = Counter(dict(
+        Votes.objects.values_list('candidate').annotate(total=Count('id')).order_by()
+    ))
+    blobs = []
+    for blob in Ballot.objects.values_list('candidates', flat=True).iterator(chunk_size=BALLOT_CHUNK_SIZE):
+        blobs.append(blob)
+        if len(blobs) == BALLOT_CHUNK_SIZE:
+            counts.update(count_packed(blobs))
+            blobs = []
+    counts.update(count_packed(blobs))
+    counts.update(dict(
+        PaperTally.objects.values_list('candidate').annotate(total=Sum('votes')).order_by()
+    ))
+    return counts
+
+
+def voter_candidate_ids(voter):
+    """Ids of the (still existing) candidates the voter voted for"""
+    ids = list(Votes.objects.filter(voter=voter).values_list('candidate_id', flat=True))
+    blob = Ballot.objects.filter(voter=voter).values_list('candidates', flat=True).first()
+    if blob is not None:
+        # Unlike Votes rows, packed ids outlive the candidates deleted since
+        ids.extend(Candidate.objects.filter(id__in=unpack_ids(blob)).values_list('id', flat=True))
+    return ids
+
+
+def expand_ballots(ballots, candidates=None):
+    """Unsaved Votes instances for each selection in `ballots`"""
+    if candidates is None:
+        candidates = Candidate.objects.select_related('position').in_bulk()
+    for ballot in ballots:
+        for candidate_id in unpack_ids(ballot.candidates):
+            candidate = candidates.get(candidate_id)
+            if candidate is not None:
+                yield Votes(voter=ballot.voter, candidate=candidate, position=candidate.position)
+
+
+def voter_votes(voter):
+    """The voter's votes, with candidate and position loaded"""
+    votes = list(Votes.objects.filter(voter=voter).select_related('candidate', 'position'))
+    ballot = Ballot.objects.filter(voter=voter).first()
+    if ballot is not None:
+        ballot.voter = voter
+        votes.extend(expand_ballots([ballot]))
+    return votes
+
+
+def ranking_groups(position_ids):
+    """
+    {position_id: {ranking tuple: number of voters}} for the given ranked
+    positions. Rankings are grouped on their packed form, so each distinct
+    ranking is unpacked once however many voters cast it.
+    """
+    packed = {position_id: Counter() for position_id in position_ids}
+    rankings = (
+        Ranking.objects.filter(position_id__in=position_ids)
+        .values_list('position_id', 'candidates')
+        .iterator(chunk_size=BALLOT_CHUNK_SIZE)
+    )
+    for position_id, blob in rankings:
+        packed[position_id][bytes(blob)] += 1
+    return {
+        position_id: {tuple(unpack_ids(blob)): count for blob, count in counter.items()}
+        for position_id, counter in packed.items()
+    }
+
+
+def votes_page(cursor='', limit=50, position_id=None, candidate_id=None):
+    """
+    One page of votes, in keyset order over both storages, with voter,
+    candidate and position loaded. Returns (votes, next_cursor).
+
+    `cursor` is '' for the first page and otherwise the next_cursor of the
+    page before, which is None after the last page. Votes rows are paged on
+    their id, then ballots on theirs. Ballots are not split across pages,
+    so a page can hold a few votes over `limit`, and with a filter the last
+    page can come back empty.
+    """
+    storage, _, last_id = cursor.partition(':')
+    last_id = int(last_id or 0)
+    votes = []
+    if storage in ('', 'rows'):
+        rows = Votes.objects.select_related('voter__admin', 'candidate', 'position').order_by('id')
+        if position_id is not None:
+            rows = rows.filter(position_id=position_id)
+        if candidate_id is not None:
+            rows = rows.filter(candidate_id=candidate_id)
+        votes = list(rows.filter(id__gt=last_id)[:limit + 1])
+        if len(votes) > limit:
+            return votes[:limit], f"rows:{votes[limit - 1].id}"
+        last_id = 0
+
+    ballots = Ballot.objects.select_related('voter__admin').order_by('id')
+    candidates = None
+    while True:
+        chunk = list(ballots.filter(id__gt=last_id)[:limit])
+        if not chunk:
+            return votes, None
+        if candidates is None:
+            candidates = Candidate.objects.select_related('position').in_bulk()
+        for ballot in chunk:
+            if len(votes) >= limit:
+                return votes, f"ballots:{last_id}"
+            votes.extend(
+                vote for vote in expand_ballots([ballot], candidates)
+                if (position_id is None or vote.position_id == position_id)
+                and (candidate_id is None or vote.candidate_id == candidate_id)
+            )
+            last_id = ballot.id
@@ -0,0 +1,147 @@
+"""
+Single transferable vote for ranked positions (instant-runoff when there is
+one seat).
+
+Identical rankings are counted once, with a multiplicity, and every round
+only moves the ballots of the candidate just elected or eliminated: each
+candidate keeps the pile of ballot groups currently counting for it, so a
+round costs the size of one pile rather than a pass over every ballot.
+
+Counting rules: Droop quota, one election per round (the largest total
+first), Gregory fractional transfer of surpluses and elimination of the
+lowest candidate otherwise. Ties are broken by the totals of earlier
+rounds, most recent first, and then by the order of `candidates`: the
+earlier candidate is elected, the later one eliminated. When no more
+candidates are left than seats, those with any votes are all elected; as
+with plurality, a candidate without votes never is.
+"""
+from collections import Counter
+
+from .storage import ranking_groups
+
+# Tolerance when comparing fractional totals with the quota
+EPS = 1e-9
+
+
+def stv(ballots, seats, candidates=None):
+    """`ballots` is an iterable of rankings (candidate ids, first preference first)"""
+    return stv_grouped(Counter(map(tuple, ballots)), seats, candidates)
+
+
+def stv_grouped(groups, seats, candidates=None):
+    """
+    Count `groups` ({ranking tuple: number of ballots}) for `seats` seats.
+    Candidates missing from `candidates` (default: everyone ranked) are
+    skipped on the ballots.
+
+    Returns a dict with 'elected' (candidate ids in order of election),
+    'quota', 'exhausted' (weight of ballots with no continuing preference
+    left) and 'rounds', one dict per round with the 'totals' of the
+    continuing candidates and the candidate 'elected' or 'eliminated'.
+    """
+    if candidates is None:
+        candidates = sorted({c for ranking in groups for c in ranking})
+    order = {c: i for i, c in enumerate(candidates)}
+
+    prefs, counts = [], []
+    for ranking, count in groups.items():
+        seen, cleaned = set(), []
+        for c in ranking:
+            if c in order and c not in seen:
+                seen.add(c)
+                cleaned.append(c)
+        if cleaned and count > 0:
+            prefs.append(cleaned)
+            counts.append(count)
+
+    valid = sum(counts)
+    quota = valid // (seats + 1) + 1
+    weight = [1.0] * len(prefs)
+    pointer = [0] * len(prefs)
+    piles = {c: [] for c in candidates}
+    totals = dict.fromkeys(candidates, 0.0)
+    for g, ranking in enumerate(prefs):
+        piles[ranking[0]].append(g)
+        totals[ranking[0]] += counts[g]
+
+    continuing = set(candidates)
+    elected, rounds, history = [], [], []
+    exhausted = 0.0
+
+    def transfer(candidate, factor):
+        nonlocal exhausted
+        for g in piles.pop(candidate):
+            weight[g] *= factor
+            ranking, p = prefs[g], pointer[g] + 1
+            while p < len(ranking) and ranking[p] not in continuing:
+                p += 1
+            pointer[g] = p
+            if p < len(ranking):
+                piles[ranking[p]].append(g)
+                totals[ranking[p]] += counts[g] * weight[g]
+            else:
+                exhausted += counts[g] * weight[g]
+
+    def tiebreak(c):
+        return (round(totals[c], 6),) + tuple(round(h.get(c, 0.0), 6) for h in reversed(history))
+
+    while len(elected) < seats and continuing:
+        snapshot = {c: totals[c] for c in continuing}
+        if len(continuing) <= seats - len(elected):
+            winners = sorted((c for c in continuing if totals[c] > EPS),
+                             key=lambda c: (-totals[c], order[c]))
+            elected.extend(winners)
+            rounds.append({'totals': snapshot, 'elected': winners, 'eliminated': None})
+            break
+
+        reaching = [c for c in continuing if totals[c] >= quota - EPS]
+        if reaching:
+            winner = max(reaching, key=lambda c: (tiebreak(c), -order[c]))
+            continuing.discard(winner)
+            elected.append(winner)
+            surplus = totals[winner] - quota
+            if surplus > EPS and len(elected) < seats:
+                transfer(winner, surplus / totals[winner])
+            else:
+                piles.pop(winner)
+            rounds.append({'totals': snapshot, 'elected': [winner], 'eliminated': None})
+        else:
+            loser = min(continuing, key=lambda c: (tiebreak(c), -order[c]))
+            continuing.discard(loser)
+            transfer(loser, 1.0)
+            del totals[loser]
+            rounds.append({'totals': snapshot, 'elected': [], 'eliminated': loser})
+        history.append(snapshot)
+
+    return {'elected': elected, 'quota': quota, 'exhausted': exhausted, 'rounds': rounds}
+
+
+def tally_ranked_positions(positions, groups=None):
+    """
+    Redo the outcome of the ranked positions among `positions` (as returned
+    by tally.tally_positions) from their rankings, in place. Their
+    'winners' become the STV winners in order of election, with no 'ties',
+    and they gain 'quota' and 'rounds'. Positions that are not ranked are
+    left alone.
+
+    `groups` is {position_id: {ranking tuple: count}}; by default the
+    stored rankings are read (storage.ranking_groups), with no query made
+    when no position is ranked.
+    """
+    ranked = [position for position in positions if position.get('ranked')]
+    if not ranked:
+        return positions
+
+    if groups is None:
+        groups = ranking_groups([position['id'] for position in ranked])
+    for position in ranked:
+        by_id = {c['id']: c for c in position['candidates']}
+        result = stv_grouped(groups.get(position['id'], {}), position['max_vote'], list(by_id))
+        elected = set(result['elected'])
+        for candidate in position['candidates']:
+            candidate.update(elected=candidate['id'] in elected, tied=False)
+        position['winners'] = [by_id[c] for c in result['elected']]
+        position['ties'] = []
+        position['quota'] = result['quota']
+        position['rounds'] = len(result['rounds'])
+    return positions
@@ -0,0 +1,186 @@
+"""
+Tally engine: winners, ties, vote shares and margins for every position at
+once, from flat per-candidate arrays.
+
+Uses NumPy when it is installed and falls back to plain Python otherwise;
+both give the same results.
+"""
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+def tally_arrays(position, votes, seats):
+    """
+    `position[i]` is the index (0..P-1) of candidate i's position, `votes[i]`
+    its vote count and `seats[p]` the number of winners of position p.
+
+    Returns a dict of sequences. Per candidate: 'rank' (0 is the most
+    votes), 'elected', 'tied' (in a tie for the last seat(s), so neither
+    elected nor out), 'share' of the position's votes. Per position:
+    'total' votes, 'cutoff' (votes of the last seat) and 'margin' between
+    the last seat and the best candidate left out, or -1 when there are no
+    more candidates than seats.
+
+    A candidate without votes is never elected.
+    """
+    if np is not None:
+        return _tally_numpy(position, votes, seats)
+    return _tally_python(position, votes, seats)
+
+
+def _tally_numpy(position, votes, seats):
+    position = np.asarray(position, dtype=np.int64)
+    votes = np.asarray(votes, dtype=np.int64)
+    seats = np.asarray(seats, dtype=np.int64)
+    num_positions, num_candidates = len(seats), len(votes)
+
+    # Sort by position, then by votes descending, in one pass
+    order = np.lexsort((-votes, position))
+    sorted_votes = votes[order]
+    counts = np.bincount(position, minlength=num_positions)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    rank = np.empty(num_candidates, dtype=np.int64)
+    rank[order] = np.arange(num_candidates) - starts[position[order]]
+
+    totals = np.bincount(position, weights=votes, minlength=num_positions).astype(np.int64)
+    filled = np.minimum(seats, counts)
+    has_seat = filled > 0
+    cutoff = np.zeros(num_positions, dtype=np.int64)
+    cutoff[has_seat] = sorted_votes[(starts + filled - 1)[has_seat]]
+    contested = counts > seats
+    runner_up = np.zeros(num_positions, dtype=np.int64)
+    runner_up[contested] = sorted_votes[(starts + seats)[contested]]
+    margin = np.where(contested, cutoff - runner_up, -1)
+
+    candidate_cutoff = cutoff[position]
+    above = votes > candidate_cutoff
+    at = (votes == candidate_cutoff) & (votes > 0)
+    # More candidates at or above the cutoff than seats: the cutoff is a tie
+    overflow = np.bincount(position, weights=above | at, minlength=num_positions) > seats
+    tied = at & overflow[position]
+    elected = (above | at) & ~tied & (votes > 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = np.where(totals[position] > 0, votes / totals[position], 0.0)
+
+    return {
+        'rank': rank, 'elected': elected, 'tied': tied, 'share': share,
+        'total': totals, 'cutoff': cutoff, 'margin': margin,
+    }
+
+
+def _tally_python(position, votes, seats):
+    position, votes, seats = list(position), list(votes), list(seats)
+    num_positions, num_candidates = len(seats), len(votes)
+    members = [[] for _ in range(num_positions)]
+    for i, p in enumerate(position):
+        members[p].append(i)
+
+    rank = [0] * num_candidates
+    elected = [False] * num_candidates
+    tied = [False] * num_candidates
+    share = [0.0] * num_candidates
+    totals, cutoffs, margins = [0] * num_positions, [0] * num_positions, [-1] * num_positions
+    for p, indices in enumerate(members):
+        # Stable sort keeps the same order as the NumPy lexsort for equal votes
+        indices.sort(key=lambda i: -votes[i])
+        total = sum(votes[i] for i in indices)
+        totals[p] = total
+        for r, i in enumerate(indices):
+            rank[i] = r
+            share[i] = votes[i] / total if total else 0.0
+        filled = min(seats[p], len(indices))
+        if filled == 0:
+            continue
+        cutoff = votes[indices[filled - 1]]
+        cutoffs[p] = cutoff
+        if len(indices) > seats[p]:
+            margins[p] = cutoff - votes[indices[seats[p]]]
+        reaching = [i for i in indices if votes[i] >= cutoff and votes[i] > 0]
+        for i in reaching:
+            if len(reaching) > seats[p] and votes[i] == cutoff:
+                tied[i] = True
+            else:
+                elected[i] = True
+
+    return {
+        'rank': rank, 'elected': elected, 'tied': tied, 'share': share,
+        'total': totals, 'cutoff': cutoffs, 'margin': margins,
+    }
+
+
+def tally_positions(positions):
+    """
+    Run the engine over positions shaped like votes.results_by_position()
+    and add the outcome to them in place. Each candidate gets 'rank',
+    'elected', 'tied' and 'share'; each position gets 'total', 'margin',
+    'winners' and 'ties' (candidate dicts, most votes first).
+    """
+    position_index, votes, seats = [], [], []
+    for p, position in enumerate(positions):
+        seats.append(position['max_vote'])
+        for candidate in position['candidates']:
+            position_index.append(p)
+            votes.append(candidate['votes'])
+
+    result = tally_arrays(position_index, votes, seats)
+    rank = list(map(int, result['rank']))
+    elected = list(map(bool, result['elected']))
+    tied = list(map(bool, result['tied']))
+    share = list(map(float, result['share']))
+
+    i = 0
+    for p, position in enumerate(positions):
+        for candidate in position['candidates']:
+            candidate.update(rank=rank[i], elected=elected[i], tied=tied[i], share=share[i])
+            i += 1
+        ranked = sorted(position['candidates'], key=lambda c: c['rank'])
+        position['total'] = int(result['total'][p])
+        margin = int(result['margin'][p])
+        position['margin'] = None if margin < 0 else margin
+        position['winners'] = [c for c in ranked if c['elected']]
+        position['ties'] = [c for c in ranked if c['tied']]
+    return positions
+
+
+def describe_outcome(position):
+    """
+    One line summary of a tallied position, for the dashboard and the result
+    PDF. Candidate names are escaped; the result is safe HTML.
+    """
+    if not position['candidates']:
+        return "Position does not have candidates"
+    if position['total'] == 0:
+        return "No one voted for this position yet."
+
+    parts = []
+    winners = position['winners']
+    separator = mark_safe(", &nbsp;")
+    if position.get('ranked'):
+        # Filled by STV (voting/stv.py); votes shown are first preferences
+        if not winners:
+            return "No one ranked a candidate for this position yet."
+        return format_html(
+            "{} : {} (ranked count, quota {}, {} rounds)",
+            "Winner" if len(winners) == 1 else "Winners",
+            format_html_join(separator, "{}", ((c['name'],) for c in winners)),
+            position['quota'], position['rounds'])
+    if winners:
+        if position['max_vote'] == 1:
+            parts.append(format_html("Winner : {}", winners[0]['name']))
+        else:
+            parts.append(format_html("Winners : {}", format_html_join(
+                separator, "{} with {} votes", ((c['name'], c['votes']) for c in winners))))
+    ties = position['ties']
+    if ties:
+        open_seats = position['max_vote'] - len(winners)
+        seats = "seat" if open_seats == 1 else "seats"
+        parts.append(
+            f"There are {len(ties)} candidates with {ties[0]['votes']} votes "
+            f"for {open_seats} {seats}")
+    return format_html_join(". ", "{}", ((part,) for part in parts))
@@ -0,0 +1,32 @@
+// Keeps the last ballot definition (and ballot page) so the ballot can be
+// shown while the network is down. Requests go to the network first; the
+// ballot carries an ETag, so a fresh copy usually costs a 304.
+var CACHE = 'ballot';
+var CACHED_PATHS = ['{% url "fetch_ballot" %}', '{% url "show_ballot" %}'];
+
+self.addEventListener('install', function(event) {
+  self.skipWaiting();
+});
+
+self.addEventListener('activate', function(event) {
+  event.waitUntil(self.clients.claim());
+});
+
+self.addEventListener('fetch', function(event) {
+  var url = new URL(event.request.url);
+  if (event.request.method !== 'GET' || CACHED_PATHS.indexOf(url.pathname) === -1) {
+    return;
+  }
+  event.respondWith(
+    caches.open(CACHE).then(function(cache) {
+      return fetch(event.request).then(function(response) {
+        if (response.ok) {
+          cache.put(event.request, response.clone());
+        }
+        return response;
+      }).catch(function() {
+        return cache.match(event.request);
+      });
+    })
+  );
+});
@@ -1,3 +1,862 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.text import slugify
+from PIL import Image
+
+from .archive import ElectionArchive, InvalidArchive, write_archive
+from .ballot import InvalidBallot, get_ballot_html, get_ballot_schema, get_ballot_version
+from .checks import check_shared_cache
+from account.models import CustomUser
+from .deletion import get_job, run_delete, start_delete
+from .export import VOTE_COLUMNS, export
+from .models import Ballot, Position, Candidate, Ranking, Station, Voter, Votes, VoteTally
+from .paper import InvalidPaperImport, import_paper
+from .storage import count_packed, count_votes, pack_ids, unpack_ids, voter_votes, votes_page
+from .stv import stv, tally_ranked_positions
+from .voter_index import search_voters
+from . import deletion, tally
+from .tally import describe_outcome, tally_positions
+from .votes import (
+    AlreadyVoted, get_tallies, rebuild_tallies, record_ballot, reset_election, results_by_position,
+    tally_shards,
+)
+
+
+class BallotCacheTests(TestCase):
+    """Tests related to the cached ballot in voting/ballot.py."""
+
+    def setUp(self):
+        cache.clear()
+        self.president = Position.objects.create(name='President', max_vote=1, priority=1)
+        self.coordinator = Position.objects.create(name='Sports Coordinator', max_vote=2, priority=2)
+        self.alice = Candidate.objects.create(
+            fullname='Alice', bio='-', photo='candidates/a.jpg', position=self.president)
+        Candidate.objects.create(
+            fullname='Bob', bio='-', photo='candidates/b.jpg', position=self.coordinator)
+
+    def test_ballot_is_rendered_from_two_queries_then_cached(self):
+        """The first render costs two reads and no writes; later ones hit no DB."""
+        with self.assertNumQueries(2):
+            html = get_ballot_html()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_ballot_html(), html)
+        self.assertIn('type="radio" value="%s"' % self.alice.id, html)
+        self.assertIn('name="sports-coordinator[]"', html)
+
+    def test_candidate_change_invalidates_ballot(self):
+        """Saving a candidate makes the next request re-render the ballot."""
+        get_ballot_html()
+        with self.captureOnCommitCallbacks(execute=True):
+            Candidate.objects.create(
+                fullname='Carol', bio='-', photo='candidates/c.jpg', position=self.president)
+        self.assertIn('Carol', get_ballot_html())
+
+    def test_names_are_escaped(self):
+        """Position and candidate names are shown as text on the ballot."""
+        with self.captureOnCommitCallbacks(execute=True):
+            Candidate.objects.create(
+                fullname='<script>alert(1)</script>', bio='-', photo='candidates/c.jpg',
+                position=self.president)
+            self.president.name = 'Chair & <i>Head</i>'
+            self.president.save()
+        html = get_ballot_html()
+        self.assertNotIn('<script>alert(1)</script>', html)
+        self.assertIn('&lt;script&gt;alert(1)&lt;/script&gt;', html)
+        self.assertIn('<b>Chair &amp; &lt;i&gt;Head&lt;/i&gt;</b>', html)
+
+    def test_ballot_version_changes_only_on_commit(self):
+        """An uncommitted edit leaves the ballot version alone."""
+        version = get_ballot_version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.president.name = 'Chair'
+            self.president.save()
+            self.assertEqual(get_ballot_version(), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_ballot_version(), version)
+
+    def test_deploy_check_flags_a_per_process_cache(self):
+        """The ballot version must live in a cache every worker shares."""
+        self.assertEqual([w.id for w in check_shared_cache(None)], ['voting.W001'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_position_delete_renumbers_priorities(self):
+        """Deleting a position closes the gap it leaves in the ballot order."""
+        self.president.delete()
+        self.coordinator.refresh_from_db()
+        self.assertEqual(self.coordinator.priority, 1)
+        self.assertNotIn('President', get_ballot_html())
+
+    def test_rotated_ballot_is_stable_per_voter_and_costs_no_queries(self):
+        """Rotation reorders cached fragments deterministically per voter."""
+        for name in ('Carol', 'Dave', 'Erin', 'Frank'):
+            Candidate.objects.create(
+                fullname=name, bio='-', photo='candidates/x.jpg', position=self.president)
+        get_ballot_html()
+        with self.assertNumQueries(0):
+            orders = {get_ballot_html(voter_id) for voter_id in range(20)}
+        self.assertGreater(len(orders), 1)
+        self.assertEqual(get_ballot_html(7), get_ballot_html(7))
+        self.assertEqual(sorted(get_ballot_html(7)), sorted(get_ballot_html()))
+
+
+class BallotSchemaTests(TestCase):
+    """Tests related to validating submitted ballots against BallotSchema."""
+
+    def setUp(self):
+        cache.clear()
+        self.president = Position.objects.create(name='President', max_vote=1, priority=1)
+        self.coordinator = Position.objects.create(name='Sports Coordinator', max_vote=2, priority=2)
+        self.alice = Candidate.objects.create(
+            fullname='Alice', bio='-', photo='candidates/a.jpg', position=self.president)
+        self.bob = Candidate.objects.create(
+            fullname='Bob', bio='-', photo='candidates/b.jpg', position=self.coordinator)
+        self.carol = Candidate.objects.create(
+            fullname='Carol', bio='-', photo='candidates/c.jpg', position=self.coordinator)
+
+    def test_clean_maps_form_keys_without_queries(self):
+        """A warm schema validates a ballot with no database access."""
+        schema = get_ballot_schema()
+        data = QueryDict(
+            f'csrfmiddlewaretoken=x&president={self.alice.id}'
+            f'&sports-coordinator[]={self.bob.id}&sports-coordinator[]={self.carol.id}')
+        with self.assertNumQueries(0):
+            selections = schema.clean(data)
+        self.assertEqual(selections, {
+            self.president.id: [self.alice.id],
+            self.coordinator.id: [self.bob.id, self.carol.id],
+        })
+
+    def test_candidate_from_another_position_is_rejected(self):
+        """A candidate id must belong to the position it was submitted under."""
+        data = QueryDict(f'president={self.bob.id}')
+        with self.assertRaises(InvalidBallot):
+            get_ballot_schema().clean(data)
+
+    def test_too_many_selections_is_rejected(self):
+        """Selecting more candidates than max_vote is rejected."""
+        dave = Candidate.objects.create(
+            fullname='Dave', bio='-', photo='candidates/d.jpg', position=self.president)
+        data = QueryDict(f'president={self.alice.id}&president={dave.id}')
+        with self.assertRaisesMessage(InvalidBallot, 'You can only select 1'):
+            get_ballot_schema().clean(data)
+
+    def test_schema_rebuilds_after_changes(self):
+        """Editing candidates produces a schema with a new version."""
+        schema = get_ballot_schema()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.carol.delete()
+        rebuilt = get_ballot_schema()
+        self.assertNotEqual(schema.version, rebuilt.version)
+        self.assertNotIn(self.carol.id, rebuilt.candidate_position)
+
+
+class BallotTestCase(TestCase):
+    """Seven single-seat positions, one candidate each, and one voter."""
+
+    def setUp(self):
+        cache.clear()
+        self.positions = [
+            Position.objects.create(name=f'Position {i}', max_vote=1, priority=i)
+            for i in range(1, 8)
+        ]
+        self.selections = {}
+        for position in self.positions:
+            candidate = Candidate.objects.create(
+                fullname=f'Candidate {position.id}', bio='-',
+                photo='candidates/x.jpg', position=position)
+            self.selections[position.id] = [candidate.id]
+        user = CustomUser.objects.create_user(
+            email='voter@example.com', password='pass', first_name='A', last_name='B')
+        self.voter = Voter.objects.create(admin=user, phone='08000000000')
+
+
+class FetchBallotTests(BallotTestCase):
+    """Tests related to the fetch_ballot endpoint."""
+
+    def setUp(self):
+        super().setUp()
+        self.admin = CustomUser.objects.create_superuser(
+            email='admin@example.com', password='pass', first_name='Ad', last_name='Min')
+        self.client.force_login(self.admin)
+
+    def test_json_ballot_lists_positions_in_priority_order(self):
+        """?format=json returns structured positions and candidates."""
+        response = self.client.get(reverse('fetch_ballot'), {'format': 'json'})
+        data = response.json()
+        self.assertEqual([p['id'] for p in data['positions']], [p.id for p in self.positions])
+        self.assertEqual(data['positions'][0]['input'], 'radio')
+        self.assertEqual(len(data['positions'][0]['candidates']), 1)
+
+    def test_matching_etag_returns_not_modified(self):
+        """A repeat fetch with the ETag gets an empty 304 until the ballot changes."""
+        url = reverse('fetch_ballot') + '?format=json'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.positions[0].delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class SubmitBallotTests(BallotTestCase):
+    """Tests related to the submit_ballot view and idempotent retries."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.voter.admin)
+        self.data = {
+            slugify(position.name): self.selections[position.id][0]
+            for position in self.positions
+        }
+
+    def submit(self, **extra):
+        return self.client.post(
+            reverse('submit_ballot'), dict(self.data, **extra),
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def test_preview_escapes_names(self):
+        """The preview lists candidate names as text."""
+        candidate = Candidate.objects.get(id=self.selections[self.positions[0].id][0])
+        candidate.fullname = '<script>alert(1)</script>'
+        with self.captureOnCommitCallbacks(execute=True):
+            candidate.save()
+        response = self.client.post(reverse('preview_vote'), self.data)
+        self.assertIn('Position 1: &lt;script&gt;alert(1)&lt;/script&gt;', response.json()['list'])
+
+    def test_retry_with_same_key_is_accepted_once(self):
+        """A queued ballot sent twice with one key is recorded once and succeeds twice."""
+        first = self.submit(idempotency_key='abc')
+        second = self.submit(idempotency_key='abc')
+        self.assertFalse(first.json()['error'])
+        self.assertFalse(second.json()['error'])
+        self.assertEqual(second.json()['redirect'], reverse('voterDashboard'))
+        self.assertEqual(Votes.objects.filter(voter=self.voter).count(), 7)
+
+    def test_second_ballot_with_other_key_is_rejected(self):
+        """A different key after voting is reported as already voted."""
+        self.submit(idempotency_key='abc')
+        response = self.submit(idempotency_key='xyz')
+        self.assertEqual(response.json()['message'], "You have already voted")
+
+    @override_settings(CLIENT_SIDE_BALLOT=True)
+    def test_client_side_ballot_skips_server_render(self):
+        """In client-side mode the ballot page is served without the ballot markup."""
+        response = self.client.get(reverse('show_ballot'))
+        self.assertTrue(response.context['client_ballot'])
+        self.assertNotIn('ballot', response.context)
+
+
+class RecordBallotTests(BallotTestCase):
+    """Tests related to writing a ballot in voting/votes.py."""
+
+    def test_ballot_written_in_constant_queries(self):
+        """All votes and the voted flag are written by a fixed number of queries."""
+        # savepoint, claim UPDATE, votes INSERT, tallies UPDATE, release
+        with self.assertNumQueries(5):
+            record_ballot(self.voter, self.selections)
+        self.assertEqual(Votes.objects.filter(voter=self.voter).count(), 7)
+        self.voter.refresh_from_db()
+        self.assertTrue(self.voter.voted)
+
+    def test_second_submission_is_rejected(self):
+        """Only the first of two submissions for the same voter claims the ballot."""
+        record_ballot(self.voter, self.selections)
+        stale = Voter.objects.get(id=self.voter.id)
+        stale.voted = False  # as seen by a request that checked before the claim
+        with self.assertRaises(AlreadyVoted):
+            record_ballot(stale, self.selections)
+        self.assertEqual(Votes.objects.filter(voter=self.voter).count(), 7)
+
+
+class VoteTallyTests(BallotTestCase):
+    """Tests related to keeping VoteTally in step with Votes."""
+
+    def test_tallies_follow_submitted_ballots(self):
+        """Each recorded vote adds one to its candidate's tally."""
+        record_ballot(self.voter, self.selections)
+        tallies = get_tallies(fresh=True)
+        for candidate_ids in self.selections.values():
+            self.assertEqual(tallies[candidate_ids[0]], 1)
+
+    def test_rebuild_matches_votes(self):
+        """rebuild_tallies recomputes drifted tallies from Votes."""
+        record_ballot(self.voter, self.selections)
+        VoteTally.objects.update(votes=42)
+        self.assertEqual(rebuild_tallies(), 7)
+        self.assertEqual(set(get_tallies(fresh=True).values()), {1})
+
+    def test_rebuild_counts_votes_after_locking_the_tallies(self):
+        """Votes are counted inside the rebuild's transaction, once writers are locked out."""
+        record_ballot(self.voter, self.selections)
+        tallies_at_count = []
+
+        def count():
+            tallies_at_count.append(VoteTally.objects.count())
+            return count_votes()
+        with mock.patch('voting.votes.count_votes', side_effect=count):
+            self.assertEqual(rebuild_tallies(), 7)
+        self.assertEqual(tallies_at_count, [0])
+
+    def test_rebuild_starts_with_the_delete_on_sqlite(self):
+        """On SQLite no read precedes the write that takes the lock."""
+        if connection.vendor != 'sqlite':
+            self.skipTest("SQLite only")
+        with CaptureQueriesContext(connection) as queries:
+            rebuild_tallies()
+        statements = [q['sql'] for q in queries.captured_queries if 'SAVEPOINT' not in q['sql']]
+        self.assertTrue(statements[0].startswith('DELETE FROM "voting_votetally"'), statements[0])
+
+    def test_deleting_voter_removes_their_votes_from_tallies(self):
+        """A deleted voter's votes no longer count."""
+        record_ballot(self.voter, self.selections)
+        self.voter.admin.delete()
+        self.assertEqual(set(get_tallies(fresh=True).values()), {0})
+
+    @override_settings(VOTE_TALLY_SHARDS=4)
+    def test_voters_update_their_own_shard(self):
+        """Votes land in the voter's shard and totals sum over all shards."""
+        user = CustomUser.objects.create_user(
+            email='second@example.com', password='pass', first_name='C', last_name='D')
+        second = Voter.objects.create(admin=user, phone='08000000001')
+        record_ballot(self.voter, self.selections)
+        record_ballot(second, self.selections)
+        candidate_id = self.selections[self.positions[0].id][0]
+        shards = dict(VoteTally.objects.filter(
+            candidate_id=candidate_id, votes__gt=0).values_list('shard', 'votes'))
+        self.assertEqual(shards, {self.voter.id % 4: 1, second.id % 4: 1})
+        self.assertEqual(get_tallies(fresh=True)[candidate_id], 2)
+
+
+@override_settings(VOTE_STORAGE='ballots')
+class BallotStorageTests(BallotTestCase):
+    """Tests related to storing one packed Ballot row per voter."""
+
+    def test_deleting_voter_after_their_candidate(self):
+        """A packed ballot naming a deleted candidate does not stop the voter's delete."""
+        record_ballot(self.voter, self.selections)
+        candidate = Candidate.objects.get(id=self.selections[self.positions[0].id][0])
+        candidate.delete()
+        self.voter.admin.delete()
+        connection.check_constraints()
+        self.assertFalse(VoteTally.objects.filter(candidate_id=candidate.id).exists())
+        self.assertEqual(set(get_tallies(fresh=True).values()), {0})
+
+    def test_ballot_is_one_row(self):
+        """A ballot in 'ballots' storage is a single row and no Votes rows."""
+        record_ballot(self.voter, self.selections)
+        self.assertEqual(Ballot.objects.count(), 1)
+        self.assertFalse(Votes.objects.exists())
+        self.assertEqual(
+            sorted(unpack_ids(Ballot.objects.get().candidates)),
+            sorted(ids[0] for ids in self.selections.values()))
+
+    def test_readers_see_both_storages(self):
+        """Results and vote lists read Votes rows and packed ballots alike."""
+        record_ballot(self.voter, self.selections)
+        with self.settings(VOTE_STORAGE='rows'):
+            user = CustomUser.objects.create_user(
+                email='second@example.com', password='pass', first_name='C', last_name='D')
+            record_ballot(Voter.objects.create(admin=user, phone='08000000001'), self.selections)
+        self.assertEqual(rebuild_tallies(), 14)
+        self.assertEqual(set(get_tallies(fresh=True).values()), {2})
+        self.assertEqual(len(votes_page(limit=100)[0]), 14)
+        mine = voter_votes(self.voter)
+        self.assertEqual({vote.position for vote in mine}, set(self.positions))
+
+    def test_count_packed(self):
+        """Packed ballots are counted in bulk."""
+        counts = count_packed([pack_ids([1, 2]), pack_ids([2, 3]), pack_ids([2])])
+        self.assertEqual(counts, {1: 1, 2: 3, 3: 1})
+
+
+class TallyEngineTests(TestCase):
+    """Tests related to the tally engine in voting/tally.py."""
+
+    def tally(self, seats, *vote_lists):
+        positions = [
+            {'name': f'P{p}', 'max_vote': seats, 'candidates': [
+                {'name': f'C{p}-{i}', 'votes': v} for i, v in enumerate(votes)]}
+            for p, votes in enumerate(vote_lists)
+        ]
+        return tally_positions(positions)
+
+    def names(self, candidates):
+        return [c['name'] for c in candidates]
+
+    def test_winners_ties_and_margins(self):
+        """Clear winners, ties at the cutoff and empty positions in one pass."""
+        clear, tie, multi, empty, unvoted = self.tally(1, [3, 5, 1], [4, 4, 1], [], [], [0, 0])
+        self.assertEqual(self.names(clear['winners']), ['C0-1'])
+        self.assertEqual(clear['margin'], 2)
+        self.assertEqual(clear['candidates'][1]['share'], 5 / 9)
+        self.assertEqual(tie['winners'], [])
+        self.assertEqual(self.names(tie['ties']), ['C1-0', 'C1-1'])
+        self.assertEqual(tie['margin'], 0)
+        self.assertEqual(describe_outcome(empty), "Position does not have candidates")
+        self.assertEqual(describe_outcome(unvoted), "No one voted for this position yet.")
+        self.assertEqual(describe_outcome(tie), "There are 2 candidates with 4 votes for 1 seat")
+
+    def test_multi_seat_tie_at_cutoff(self):
+        """With two seats, a clear leader wins and a tie for the second seat is reported."""
+        position, = self.tally(2, [9, 4, 4, 1])
+        self.assertEqual(self.names(position['winners']), ['C0-0'])
+        self.assertEqual(self.names(position['ties']), ['C0-1', 'C0-2'])
+        self.assertEqual(position['margin'], 0)
+
+    def test_numpy_and_python_agree(self):
+        """Both implementations give identical results."""
+        if tally.np is None:
+            self.skipTest("NumPy is not installed")
+        rng = random.Random(1)
+        position = [p for p in range(200) for _ in range(rng.randint(0, 6))]
+        votes = [rng.randint(0, 5) for _ in position]
+        seats = [rng.randint(1, 3) for _ in range(200)]
+        fast = tally._tally_numpy(position, votes, seats)
+        slow = tally._tally_python(position, votes, seats)
+        for key in fast:
+            self.assertEqual([float(x) for x in fast[key]], [float(x) for x in slow[key]], key)
+
+
+class StvTests(TestCase):
+    """Tests related to the ranked-choice count, against published examples."""
+
+    def test_multi_seat_reference_election(self):
+        """The three-seat food election from the Wikipedia STV article."""
+        ballots = (
+            [['Orange']] * 4 + [['Pear', 'Orange']] * 2 +
+            [['Chocolate', 'Strawberry']] * 8 + [['Chocolate', 'Hamburger']] * 4 +
+            [['Strawberry']] + [['Hamburger']]
+        )
+        result = stv(ballots, 3)
+        self.assertEqual(result['quota'], 6)
+        self.assertEqual(result['elected'], ['Chocolate', 'Orange', 'Strawberry'])
+
+    def test_single_seat_reference_election(self):
+        """The Tennessee capital example from the Wikipedia IRV article."""
+        ballots = (
+            [['Memphis', 'Nashville', 'Chattanooga', 'Knoxville']] * 42 +
+            [['Nashville', 'Chattanooga', 'Knoxville', 'Memphis']] * 26 +
+            [['Chattanooga', 'Knoxville', 'Nashville', 'Memphis']] * 15 +
+            [['Knoxville', 'Chattanooga', 'Nashville', 'Memphis']] * 17
+        )
+        result = stv(ballots, 1)
+        self.assertEqual(result['elected'], ['Knoxville'])
+        self.assertEqual([r['eliminated'] for r in result['rounds'][:2]], ['Chattanooga', 'Nashville'])
+
+    def test_candidates_without_votes_are_not_elected(self):
+        """Seats stay empty rather than go to candidates nobody ranked."""
+        result = stv([['A']] * 3, 2, candidates=['A', 'B', 'C'])
+        self.assertEqual(result['elected'], ['A'])
+
+
+class RankedBallotTests(BallotTestCase):
+    """Tests related to ranked positions on the ballot and in the results."""
+
+    def setUp(self):
+        super().setUp()
+        self.ranked = self.positions[0]
+        self.ranked.ranked = True
+        self.ranked.save()
+        self.candidates = self.selections[self.ranked.id] + [
+            Candidate.objects.create(
+                fullname=f'Runner {i}', bio='-', photo='candidates/x.jpg', position=self.ranked).id
+            for i in range(2)
+        ]
+        self.key = slugify(self.ranked.name)
+
+    def ranking(self, *candidate_ids):
+        data = QueryDict(mutable=True)
+        for rank, candidate_id in enumerate(candidate_ids, start=1):
+            data[f'{self.key}:{candidate_id}'] = str(rank)
+        return data
+
+    def test_ranked_position_renders_rank_selects(self):
+        """Ranked positions get one rank select per candidate."""
+        html = get_ballot_html()
+        self.assertIn(f'name="{self.key}:{self.candidates[2]}"', html)
+        self.assertIn('<option value="3">3</option>', html)
+        self.assertEqual(get_ballot_schema().as_data()['positions'][0]['input'], 'rank')
+
+    def test_clean_returns_preference_order(self):
+        """Rankings come back first preference first; blanks are left out."""
+        first, second, third = self.candidates
+        data = self.ranking(third, first)
+        data[f'{self.key}:{second}'] = ''
+        self.assertEqual(get_ballot_schema().clean(data), {self.ranked.id: [third, first]})
+
+    def test_repeated_rank_is_rejected(self):
+        """Two candidates cannot share a rank."""
+        data = self.ranking(*self.candidates)
+        data[f'{self.key}:{self.candidates[2]}'] = '1'
+        with self.assertRaisesMessage(InvalidBallot, "Each rank can only be used once"):
+            get_ballot_schema().clean(data)
+
+    def test_rankings_decide_the_winner(self):
+        """First preferences are tallied as votes, transfers decide the seat."""
+        first, second, third = self.candidates
+        voters = [self.voter] + [
+            Voter.objects.create(admin=CustomUser.objects.create_user(
+                email=f'voter{i}@example.com', password='pass', first_name='A', last_name='B'),
+                phone=f'0810000000{i}')
+            for i in range(4)
+        ]
+        schema = get_ballot_schema()
+        for voter, ranking in zip(voters, [(first,), (first,), (second, third), (third, second), (third, second)]):
+            record_ballot(voter, schema.clean(self.ranking(*ranking)), ranked=schema.ranked)
+
+        self.assertEqual(Ranking.objects.count(), 5)
+        self.assertEqual(get_tallies(fresh=True)[second], 1)
+        position = tally_ranked_positions(tally_positions(results_by_position()))[0]
+        self.assertEqual([c['name'] for c in position['winners']], ['Runner 1'])
+        self.assertEqual(position['rounds'], 2)
+        self.assertEqual(describe_outcome(position), "Winner : Runner 1 (ranked count, quota 3, 2 rounds)")
+
+
+class VoterIndexTests(TestCase):
+    """Tests related to the in-process voter search index."""
+
+    def setUp(self):
+        cache.clear()
+        self.voters = []
+        for i, (first, last) in enumerate([('Ada', 'Lovelace'), ('Alan', 'Turing'), ('Grace', 'Hopper')]):
+            user = CustomUser.objects.create_user(
+                email=f'{first.lower()}@example.com', password='pass', first_name=first, last_name=last)
+            self.voters.append(Voter.objects.create(admin=user, phone=f'0800000000{i}'))
+
+    def test_prefix_search_over_names_email_and_phone(self):
+        """Any field can match, case-insensitively, and every word must match."""
+        ada, alan, grace = (voter.id for voter in self.voters)
+        self.assertEqual(search_voters('a'), (2, [ada, alan]))
+        self.assertEqual(search_voters('TUR'), (1, [alan]))
+        self.assertEqual(search_voters('grace@'), (1, [grace]))
+        self.assertEqual(search_voters('08000000002'), (1, [grace]))
+        self.assertEqual(search_voters('a lov'), (1, [ada]))
+        self.assertEqual(search_voters('', after=ada, limit=1), (3, [alan]))
+
+    def test_saves_and_deletes_update_the_index(self):
+        """Changes are picked up without a rebuild once committed."""
+        ada, alan, grace = self.voters
+        search_voters('')
+        user = alan.admin
+        user.last_name = 'Kay'
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+            grace.delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(search_voters('kay'), (1, [alan.id]))
+        self.assertEqual(search_voters('tur'), (0, []))
+        self.assertEqual(search_voters(''), (2, [ada.id, alan.id]))
+
+
+class ResetElectionTests(BallotTestCase):
+    """Tests related to resetting the election."""
+
+    def test_reset_removes_votes_in_chunks(self):
+        """Both storages are emptied range by range and voters can vote again."""
+        record_ballot(self.voter, self.selections)
+        user = CustomUser.objects.create_user(
+            email='other@example.com', password='pass', first_name='C', last_name='D')
+        other = Voter.objects.create(admin=user, phone='08000000001')
+        with override_settings(VOTE_STORAGE='ballots'):
+            record_ballot(other, self.selections)
+
+        progress = []
+        removed = reset_election(lambda *args: progress.append(args), chunk_size=3)
+        self.assertEqual(removed, {'voting.Votes': 7, 'voting.Ballot': 1, 'voting.Ranking': 0,
+                                   'voting.PaperTally': 0})
+        self.assertEqual(progress[-2:], [('voting.Votes', 7, 7), ('voting.Ballot', 1, 1)])
+        self.assertEqual(len(progress), 4)
+        self.assertFalse(Votes.objects.exists() or Ballot.objects.exists())
+        self.assertFalse(Voter.objects.filter(voted=True).exists())
+        self.assertEqual(set(get_tallies(fresh=True).values()), {0})
+
+
+class DeletionTests(BallotTestCase):
+    """Tests related to deleting positions, candidates and voters in the background."""
+
+    def setUp(self):
+        super().setUp()
+        self.voters = [self.voter] + [
+            Voter.objects.create(admin=CustomUser.objects.create_user(
+                email=f'voter{i}@example.com', password='pass', first_name='A', last_name='B'),
+                phone=f'0810000000{i}')
+            for i in range(4)
+        ]
+        for voter in self.voters:
+            record_ballot(voter, self.selections)
+
+    def run_job(self, kind, pk, chunk_size=2):
+        with mock.patch('voting.deletion.threading.Thread') as thread:
+            job_id = start_delete(kind, pk)
+        self.assertEqual(get_job(job_id)['finished'], False)
+        run_delete(*thread.call_args.kwargs['args'], chunk_size=chunk_size)
+        return get_job(job_id)
+
+    def test_position_votes_are_removed_in_chunks(self):
+        """The position's votes go in chunks, reported as they go, before the position itself."""
+        position = self.positions[0]
+        done, save_job = [], deletion._save_job
+        with mock.patch('voting.deletion._save_job',
+                        lambda job_id, job: done.append(job['done']) or save_job(job_id, job)):
+            job = self.run_job('position', position.id)
+        self.assertEqual(job, {'kind': 'position', 'id': position.id, 'done': 5, 'total': 5,
+                               'finished': True, 'error': ''})
+        self.assertEqual(done, [0, 0, 2, 4, 5, 5])
+        self.assertFalse(Position.objects.filter(id=position.id).exists())
+        self.assertEqual(Votes.objects.count(), 5 * 6)
+
+    def test_voter_leaves_the_tallies(self):
+        """Deleting a voter removes their user and takes their votes off the tallies."""
+        job = self.run_job('voter', self.voter.id)
+        self.assertEqual((job['finished'], job['error']), (True, ''))
+        self.assertFalse(CustomUser.objects.filter(email='voter@example.com').exists())
+        self.assertEqual(set(get_tallies(fresh=True).values()), {4})
+
+    def test_missing_object_finishes_with_error(self):
+        """A job for an object deleted in the meantime reports it."""
+        job = self.run_job('candidate', 0)
+        self.assertEqual((job['finished'], job['error']), (True, "This candidate no longer exists"))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ImportVotersTests(TestCase):
+    """Tests related to the import_voters command."""
+
+    def setUp(self):
+        cache.clear()
+        CustomUser.objects.create_user(
+            email='taken@example.com', password='pass', first_name='A', last_name='B')
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'roll.csv')
+        with open(self.path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['last_name', 'first_name', 'email', 'phone', 'password'])
+            for i in range(5):
+                writer.writerow([f'Last{i}', f'First{i}', f'Student{i}@Example.com', f'0700000000{i}', 'secret'])
+            writer.writerow(['Again', 'Row', 'student0@example.com', '07100000000', 'secret'])
+            writer.writerow(['Taken', 'Row', 'taken@example.com', '07100000001', 'secret'])
+            writer.writerow(['No', 'Email', 'not-an-email', '07100000002', 'secret'])
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def import_voters(self, **options):
+        out = io.StringIO()
+        call_command('import_voters', self.path, batch_size=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_import_and_rejects(self):
+        """Valid rows become voters who can log in; the others go to the rejects file."""
+        out = self.import_voters(workers=1)
+        self.assertIn("Imported 5 voters", out)
+        self.assertEqual(Voter.objects.count(), 5)
+        self.assertIsNotNone(authenticate(email='student3@example.com', password='secret'))
+        self.assertEqual(search_voters('last4')[0], 1)
+        with open(os.path.join(self.dir.name, 'roll.rejects.csv'), newline='') as f:
+            rejects = [(row['email'], row['error']) for row in csv.DictReader(f)]
+        self.assertEqual(rejects, [
+            # Checks within the file come before those against the database
+            ('student0@example.com', "Email repeated in this file"),
+            ('not-an-email', "Invalid email"),
+            ('taken@example.com', "The given email is already registered"),
+        ])
+
+    def test_pool_and_rerun(self):
+        """Passwords hashed in the pool work, and a second run imports nothing."""
+        self.import_voters(workers=2)
+        self.assertIsNotNone(authenticate(email='student1@example.com', password='secret'))
+        self.assertIn("Imported 0 voters", self.import_voters(workers=2))
+        self.assertEqual(Voter.objects.count(), 5)
+
+
+class ImportCandidatesTests(TestCase):
+    """Tests related to the import_candidates command."""
+
+    def setUp(self):
+        cache.clear()
+        self.dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT=os.path.join(self.dir.name, 'media'))
+        self.settings.enable()
+        self.zip_path = os.path.join(self.dir.name, 'photos.zip')
+        with zipfile.ZipFile(self.zip_path, 'w') as archive:
+            for name in ('a.png', 'b.png'):
+                image = io.BytesIO()
+                Image.new('RGB', (4, 4)).save(image, 'PNG')
+                archive.writestr(name, image.getvalue())
+            archive.writestr('broken.png', b'not an image')
+        self.manifest = os.path.join(self.dir.name, 'manifest.csv')
+
+    def tearDown(self):
+        self.settings.disable()
+        self.dir.cleanup()
+
+    def import_candidates(self, *rows):
+        with open(self.manifest, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['position', 'max_vote', 'fullname', 'bio', 'photo'])
+            writer.writerows(rows)
+        out = io.StringIO()
+        call_command('import_candidates', self.manifest, self.zip_path, stdout=out)
+        return out.getvalue()
+
+    def test_reimport_skips_unchanged(self):
+        """A second run only touches the candidate whose row changed."""
+        rows = [('President', '1', 'Ada', 'First', 'a.png'), ('President', '1', 'Alan', 'Second', 'b.png')]
+        self.assertIn("2 candidates created", self.import_candidates(*rows))
+        president = Position.objects.get(name='President')
+        self.assertEqual(president.priority, 1)
+        self.assertEqual(VoteTally.objects.filter(candidate__position=president).count(), 2 * tally_shards())
+        photo = Candidate.objects.get(fullname='Ada').photo.name
+
+        rows[1] = ('President', '1', 'Alan', 'Changed', 'b.png')
+        self.assertIn("0 candidates created, 1 updated, 1 unchanged", self.import_candidates(*rows))
+        self.assertEqual(Candidate.objects.get(fullname='Alan').bio, 'Changed')
+        self.assertEqual(Candidate.objects.get(fullname='Ada').photo.name, photo)
+
+    def test_bad_photo_imports_nothing(self):
+        """A photo that is not an image stops the import before anything is written."""
+        with self.assertRaisesMessage(CommandError, "broken.png: not a usable image"):
+            self.import_candidates(('President', '1', 'Ada', 'First', 'a.png'),
+                                   ('President', '1', 'Alan', 'Second', 'broken.png'))
+        self.assertFalse(Position.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.dir.name, 'media', 'candidates')), [])
+
+
+class PaperImportTests(BallotTestCase):
+    """Tests related to importing paper ballots and station counts."""
+
+    def lines(self, *rows):
+        out = io.StringIO()
+        csv.writer(out).writerows(rows)
+        return io.StringIO(out.getvalue())
+
+    def test_ballots_are_counted_once_per_station(self):
+        """Valid ballots reach the tallies, spoilt ones are counted, and a station imports once."""
+        first, second = self.positions[:2]
+        a, b = self.selections[first.id][0], self.selections[second.id][0]
+        header = ['station', slugify(first.name), slugify(second.name)]
+        rows = [header, ['S1', a, b], ['S1', a, ''], ['S1', b, a], ['S2', '', b]]
+
+        results = import_paper(self.lines(*rows))
+        self.assertEqual({code: outcome for code, (station, outcome) in results.items()},
+                         {'S1': 'imported', 'S2': 'imported'})
+        s1 = Station.objects.get(code='S1')
+        self.assertEqual((s1.ballots, s1.spoilt), (3, 1))
+        tallies = get_tallies(fresh=True)
+        self.assertEqual((tallies[a], tallies[b]), (2, 2))
+
+        results = import_paper(self.lines(*rows))
+        self.assertEqual(results['S1'][1], 'already imported')
+        self.assertEqual(get_tallies(fresh=True), tallies)
+        rebuild_tallies()
+        self.assertEqual(get_tallies(fresh=True), tallies)
+
+    def test_station_counts_with_errors_are_left_out(self):
+        """Aggregate counts are all or nothing per station; unknown positions reject the file."""
+        a, b = self.selections[self.positions[0].id][0], self.selections[self.positions[1].id][0]
+        results = import_paper(self.lines(
+            ['station', 'candidate', 'votes'], ['S1', a, 10], ['S1', b, 4], ['S2', a, 3], ['S2', 999, 1]))
+        self.assertEqual(results['S1'][1], 'imported')
+        self.assertEqual(results['S2'][1], "Line 5: unknown candidate 999")
+        self.assertEqual(get_tallies(fresh=True)[a], 10)
+        self.assertIsNone(Station.objects.get(code='S1').ballots)
+
+        with self.assertRaisesMessage(InvalidPaperImport, "Unknown positions: mayor"):
+            import_paper(self.lines(['station', 'mayor'], ['S3', a]))
+
+
+class ExportTests(BallotTestCase):
+    """Tests related to the streaming exports of votes and results."""
+
+    def test_votes_over_both_storages(self):
+        """Votes rows and packed ballots are exported alike, in CSV and NDJSON."""
+        record_ballot(self.voter, self.selections)
+        user = CustomUser.objects.create_user(
+            email='other@example.com', password='pass', first_name='C', last_name='D')
+        other = Voter.objects.create(admin=user, phone='08000000001')
+        with override_settings(VOTE_STORAGE='ballots'):
+            record_ballot(other, self.selections)
+
+        lines = ''.join(export('votes', 'csv', chunk_size=3)).splitlines()
+        self.assertEqual(lines[0], ','.join(VOTE_COLUMNS))
+        self.assertEqual(len(lines), 1 + 2 * 7)
+        first = self.positions[0]
+        self.assertIn(f"{other.id},D,C,{first.id},{first.name},{self.selections[first.id][0]},"
+                      f"Candidate {first.id}", lines)
+
+        rows = [json.loads(line) for line in ''.join(export('votes', 'ndjson', chunk_size=3)).splitlines()]
+        self.assertEqual(len(rows), 2 * 7)
+        self.assertEqual(rows[0]['voter_id'], self.voter.id)
+
+    def test_header_before_any_query(self):
+        """The CSV header is produced without touching the database."""
+        lines = export('votes', 'csv')
+        with self.assertNumQueries(0):
+            self.assertEqual(next(lines), ','.join(VOTE_COLUMNS) + '\r\n')
+
+    def test_results(self):
+        """The results export lists every candidate with their total."""
+        record_ballot(self.voter, self.selections)
+        rows = list(csv.DictReader(io.StringIO(''.join(export('results', 'csv')))))
+        self.assertEqual(len(rows), 7)
+        self.assertEqual((rows[0]['votes'], rows[0]['elected']), ('1', 'True'))
+
+
+class ArchiveTests(BallotTestCase):
+    """Tests related to election archives."""
+
+    def test_archive_outlives_reset(self):
+        """Results and turnout read back from an archive match the live ones, with no queries."""
+        ranked = self.positions[0]
+        ranked.ranked = True
+        ranked.save()
+        record_ballot(self.voter, self.selections, ranked={ranked.id})
+        user = CustomUser.objects.create_user(
+            email='other@example.com', password='pass', first_name='C', last_name='D')
+        other = Voter.objects.create(admin=user, phone='08000000001')
+        with override_settings(VOTE_STORAGE='ballots'):
+            record_ballot(other, {self.positions[1].id: self.selections[self.positions[1].id]})
+        Voter.objects.create(admin=CustomUser.objects.create_user(
+            email='idle@example.com', password='pass', first_name='E', last_name='F'), phone='08000000002')
+        live = tally_ranked_positions(tally_positions(results_by_position()))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'election.evarchive')
+            write_archive(path)
+            reset_election()
+            with self.assertNumQueries(0), ElectionArchive(path) as archive:
+                self.assertEqual(archive.results(), live)
+                turnout = archive.turnout()
+        self.assertEqual(turnout['positions'], dict.fromkeys(self.selections, 1) | {self.positions[1].id: 2})
+        self.assertEqual((turnout['voters'], turnout['voted']), (3, 2))
+        self.assertEqual(live[0]['winners'][0]['id'], self.selections[ranked.id][0])
+
+    def test_not_an_archive(self):
+        """Other files are refused."""
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b'SQLite format 3\0' + bytes(100))
+            f.flush()
+            with self.assertRaises(InvalidArchive):
+                ElectionArchive(f.name)
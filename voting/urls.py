@@ -8,4 +8,5 @@ urlpatterns = [
     path('ballot/vote/', views.show_ballot, name='show_ballot'),
     path('ballot/vote/preview/', views.preview_vote, name='preview_vote'),
     path('ballot/vote/submit/', views.submit_ballot, name='submit_ballot'),
+    path('ballot/sw.js', views.ballot_service_worker, name='ballot_service_worker'),
 ]
@@ -1,10 +1,15 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, reverse
 from django.http import JsonResponse
 from django.contrib import messages
-from django.utils.text import slugify
+from django.views.decorators.cache import cache_control
+from django.utils.html import escape
+from django.views.decorators.http import etag
 import logging
 
-from .models import Position, Candidate, Voter, Votes
+from .ballot import InvalidBallot, get_ballot_html, get_ballot_schema, get_ballot_version
+from .storage import voter_votes
+from .votes import AlreadyVoted, is_replay, record_ballot
 from account.views import account_login
 
 logger = logging.getLogger(__name__)
@@ -26,61 +31,35 @@ def index(request):
 # =========================
 # BALLOT GENERATION
 # =========================
-def generate_ballot(display_controls=False):
-    positions = Position.objects.order_by('priority').all()
-    output = ""
-    num = 1
-
-    for position in positions:
-        candidates_data = ""
-        candidates = Candidate.objects.filter(position=position)
-
-        for candidate in candidates:
-            if position.max_vote > 1:
-                instruction = f"You may select up to {position.max_vote} candidates"
-                input_box = (
-                    f'<input type="checkbox" value="{candidate.id}" '
-                    f'class="flat-red {slugify(position.name)}" '
-                    f'name="{slugify(position.name)}[]">'
-                )
-            else:
-                instruction = "Select only one candidate"
-                input_box = (
-                    f'<input type="radio" value="{candidate.id}" '
-                    f'class="flat-red {slugify(position.name)}" '
-                    f'name="{slugify(position.name)}">'
-                )
-
-            # Removed candidate image
-            candidates_data += f"""
-                <li>
-                    {input_box}
-                    <span>{candidate.fullname}</span>
-                </li>
-            """
-
-        output += f"""
-        <div class="box box-solid" style="background-color: #f0f4f8; border-radius: 8px; padding: 10px; margin-bottom: 15px;">
-            <div class="box-header with-border">
-                <h3 class="box-title" style="color: #1f2937;"><b>{position.name}</b></h3>
-            </div>
-            <div class="box-body">
-                <p style="color: #4b5563;">{instruction}</p>
-                <ul style="list-style-type: none; padding-left: 0;">{candidates_data}</ul>
-            </div>
-        </div>
-        """
-
-        # Update priority
-        position.priority = num
-        position.save()
-        num += 1
-
-    return output
+def generate_ballot(display_controls=False, voter_id=None):
+    # Rendered once per ballot version, see voting/ballot.py
+    return get_ballot_html(voter_id)
+
+
+def ballot_rotation_seed(request):
+    """The voter id candidates are ordered by, when ROTATE_BALLOT is on"""
+    if getattr(settings, 'ROTATE_BALLOT', False) and hasattr(request.user, 'voter'):
+        return request.user.voter.id
+    return None
+
 
+def ballot_etag(request):
+    etag = f"ballot-{get_ballot_version()}-{request.GET.get('format', 'html')}"
+    seed = ballot_rotation_seed(request)
+    return etag if seed is None else f"{etag}-{seed}"
 
+
+@etag(ballot_etag)
+@cache_control(no_cache=True)
 def fetch_ballot(request):
-    return JsonResponse(generate_ballot(True), safe=False)
+    """
+    The ballot as an HTML string, or as structured data with ?format=json.
+    Repeat requests carrying the ETag get a 304 without touching the ballot.
+    """
+    seed = ballot_rotation_seed(request)
+    if request.GET.get('format') == 'json':
+        return JsonResponse(get_ballot_schema().as_data(seed))
+    return JsonResponse(generate_ballot(True, seed), safe=False)
 
 
 # =========================
@@ -90,7 +69,7 @@ def dashboard(request):
     voter = request.user.voter
 
     if voter.voted:
-        votes = Votes.objects.filter(voter=voter).select_related('candidate', 'position')
+        votes = voter_votes(voter)
         context = {
             'my_votes': votes,
         }
@@ -109,34 +88,38 @@ def show_ballot(request):
         messages.error(request, "You have already voted")
         return redirect(reverse('voterDashboard'))
 
-    context = {
-        'ballot': generate_ballot(False)
-    }
+    if getattr(settings, 'CLIENT_SIDE_BALLOT', False):
+        # The page renders the ballot from fetch_ballot?format=json
+        context = {'client_ballot': True}
+    else:
+        context = {'ballot': generate_ballot(False, ballot_rotation_seed(request))}
     return render(request, "voting/voter/ballot.html", context)
 
 
+def ballot_service_worker(request):
+    response = render(request, "voting/voter/ballot_sw.js",
+                      content_type="application/javascript")
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
 def preview_vote(request):
     if request.method != 'POST':
         return JsonResponse({"error": True, "list": ""})
 
-    form = dict(request.POST)
-    form.pop('csrfmiddlewaretoken', None)
-    output = ""
-
-    for position in Position.objects.all():
-        key = slugify(position.name)
-        values = form.get(key) or form.get(f"{key}[]")
-
-        if not values:
-            continue
-
-        if not isinstance(values, list):
-            values = [values[0]]
+    schema = get_ballot_schema()
+    try:
+        selections = schema.clean(request.POST)
+    except InvalidBallot as e:
+        return JsonResponse({"error": True, "list": str(e)})
 
-        for cid in values:
-            candidate = Candidate.objects.filter(id=cid).first()
-            if candidate:
-                output += f"<p>{position.name}: {candidate.fullname}</p>"
+    output = ""
+    for position_id, candidate_ids in selections.items():
+        position = schema.positions[position_id]
+        for rank, cid in enumerate(candidate_ids, start=1):
+            # Ranked positions list their candidates in order of preference
+            suffix = f" ({rank})" if position_id in schema.ranked else ""
+            output += f"<p>{escape(position.name)}: {escape(schema.candidate_names[cid])}{suffix}</p>"
 
     if output == "":
         return JsonResponse({"error": True, "list": ""})
@@ -144,61 +127,52 @@ def preview_vote(request):
     return JsonResponse({"error": False, "list": output})
 
 
+def ballot_response(request, level, message, to):
+    """
+    Redirect with a flash message, or for AJAX submissions (the offline
+    ballot queue) return the outcome as JSON along with where to go next.
+    """
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        if level != messages.ERROR:
+            # Shown on the page the client is sent to next
+            messages.add_message(request, level, message)
+        return JsonResponse({
+            'error': level == messages.ERROR,
+            'message': message,
+            'redirect': reverse(to),
+        })
+    messages.add_message(request, level, message)
+    return redirect(reverse(to))
+
+
 def submit_ballot(request):
     if request.method != 'POST':
-        messages.error(request, "Invalid request")
-        return redirect(reverse('show_ballot'))
+        return ballot_response(request, messages.ERROR, "Invalid request", 'show_ballot')
 
     voter = request.user.voter
+    key = request.POST.get('idempotency_key', '')[:64]
 
     if voter.voted:
-        messages.error(request, "You have already voted")
-        return redirect(reverse('voterDashboard'))
-
-    form = dict(request.POST)
-    form.pop('csrfmiddlewaretoken', None)
-    form.pop('submit_vote', None)
-
-    if not form:
-        logger.warning(f"User {voter.admin.email} submitted empty ballot")
-        messages.error(request, "Please select at least one candidate")
-        return redirect(reverse('show_ballot'))
-
-    vote_count = 0
-
-    for position in Position.objects.all():
-        key = slugify(position.name)
-        values = form.get(key) or form.get(f"{key}[]")
-
-        if not values:
-            continue
-
-        if not isinstance(values, list):
-            values = [values[0]]
-
-        if len(values) > position.max_vote:
-            messages.error(
-                request,
-                f"You can only select {position.max_vote} for {position.name}"
-            )
-            return redirect(reverse('show_ballot'))
-
-        for cid in values:
-            candidate = Candidate.objects.filter(id=cid).first()
-            if candidate:
-                Votes.objects.create(
-                    voter=voter,
-                    position=position,
-                    candidate=candidate
-                )
-                vote_count += 1
-
-    if vote_count == 0:
-        messages.error(request, "No votes recorded")
-        return redirect(reverse('show_ballot'))
-
-    voter.voted = True
-    voter.save()
-
-    messages.success(request, "Thanks for voting!")
-    return redirect(reverse('voterDashboard'))
+        if is_replay(voter, key):
+            return ballot_response(request, messages.SUCCESS, "Thanks for voting!", 'voterDashboard')
+        return ballot_response(request, messages.ERROR, "You have already voted", 'voterDashboard')
+
+    try:
+        schema = get_ballot_schema()
+        selections = schema.clean(request.POST)
+    except InvalidBallot as e:
+        return ballot_response(request, messages.ERROR, str(e), 'show_ballot')
+
+    if not selections:
+        logger.warning(f"User {request.user.email} submitted empty ballot")
+        return ballot_response(
+            request, messages.ERROR, "Please select at least one candidate", 'show_ballot')
+
+    try:
+        record_ballot(voter, selections, key, schema.ranked)
+    except AlreadyVoted:
+        if is_replay(voter, key):
+            return ballot_response(request, messages.SUCCESS, "Thanks for voting!", 'voterDashboard')
+        return ballot_response(request, messages.ERROR, "You have already voted", 'voterDashboard')
+
+    return ballot_response(request, messages.SUCCESS, "Thanks for voting!", 'voterDashboard')
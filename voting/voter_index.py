@@ -0,0 +1,139 @@
+"""
+In-process prefix index over voter names, emails and phone numbers, for
+the admin voters list.
+
+Each process keeps a sorted list of (term, voter_id) pairs and answers a
+prefix with a bisect. Voter changes are journalled in the cache under an
+increasing version (see voter_changed, called from voting/signals.py);
+before searching, a process re-reads only the voters changed since the
+version it last saw, and rebuilds from scratch if it has fallen behind
+the journal. With several processes the cache must be one they share
+(see CACHES in settings), or each only sees its own changes.
+"""
+import bisect
+import heapq
+import threading
+import time
+from operator import itemgetter
+
+from django.core.cache import cache
+
+from .models import Voter
+
+INDEX_VERSION_KEY = 'voting:voter_index_version'
+INDEX_CHANGE_KEY = 'voting:voter_index_change:%s'
+# How long journalled changes are kept, and how many are replayed at most
+# before a full rebuild is cheaper
+CHANGE_TIMEOUT = 60 * 60 * 24
+MAX_REPLAY = 1000
+
+
+class VoterIndex:
+
+    def __init__(self):
+        self.version = None
+        self.entries = []  # sorted (term, voter_id)
+        self.terms = {}  # voter_id: [term, ...]
+        self.ids = []  # sorted voter ids
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def voter_terms(last_name, first_name, email, phone):
+        return sorted({term.lower() for term in (last_name, first_name, email, phone) if term})
+
+    def build(self, rows):
+        self.terms = {row[0]: self.voter_terms(*row[1:]) for row in rows}
+        self.entries = sorted(
+            (term, voter_id) for voter_id, terms in self.terms.items() for term in terms)
+        self.ids = sorted(self.terms)
+
+    def update(self, rows, voter_ids):
+        """Replace the entries of `voter_ids` with `rows` (voters no longer in `rows` are dropped)"""
+        for voter_id in voter_ids:
+            if voter_id not in self.terms:
+                continue
+            for term in self.terms.pop(voter_id):
+                del self.entries[bisect.bisect_left(self.entries, (term, voter_id))]
+            del self.ids[bisect.bisect_left(self.ids, voter_id)]
+        for row in rows:
+            terms = self.terms[row[0]] = self.voter_terms(*row[1:])
+            for term in terms:
+                bisect.insort(self.entries, (term, row[0]))
+            bisect.insort(self.ids, row[0])
+
+    def prefixed(self, prefix):
+        """Ids of voters with a term starting with `prefix`"""
+        # Every such term sorts between these two
+        start = bisect.bisect_left(self.entries, (prefix,))
+        end = bisect.bisect_left(self.entries, (prefix + '\U0010ffff',), start)
+        return set(map(itemgetter(1), self.entries[start:end]))
+
+    def search(self, query):
+        """Ids of voters with a term starting with each word of `query`"""
+        matches = sorted(map(self.prefixed, set(query.lower().split())), key=len)
+        return matches[0].intersection(*matches[1:])
+
+
+_index = VoterIndex()
+
+
+def get_index_version():
+    version = cache.get(INDEX_VERSION_KEY)
+    if version is None:
+        cache.add(INDEX_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(INDEX_VERSION_KEY)
+    return version
+
+
+def voter_changed(voter_id):
+    """Journal a saved or deleted voter so every process re-reads it"""
+    try:
+        version = cache.incr(INDEX_VERSION_KEY)
+    except ValueError:
+        # No version yet: a fresh one makes every process rebuild
+        cache.set(INDEX_VERSION_KEY, time.time_ns(), None)
+        return
+    cache.set(INDEX_CHANGE_KEY % version, voter_id, CHANGE_TIMEOUT)
+
+
+def invalidate_index():
+    """Make every process rebuild, after voters changed without signals (bulk_create)"""
+    cache.set(INDEX_VERSION_KEY, time.time_ns(), None)
+
+
+def _rows(voters):
+    return voters.values_list('id', 'admin__last_name', 'admin__first_name', 'admin__email', 'phone')
+
+
+def _sync(index):
+    version = get_index_version()
+    if index.version == version:
+        return
+    if index.version is not None and 0 < version - index.version <= MAX_REPLAY:
+        keys = [INDEX_CHANGE_KEY % v for v in range(index.version + 1, version + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) == len(keys):
+            voter_ids = set(changes.values())
+            index.update(_rows(Voter.objects.filter(id__in=voter_ids)), voter_ids)
+            index.version = version
+            return
+    index.build(_rows(Voter.objects.all()))
+    index.version = version
+
+
+def search_voters(query, after=0, limit=50):
+    """
+    (number of matches, ids of the first `limit` matching voters after
+    voter id `after`, ascending) for a prefix search over names, emails
+    and phone numbers. An empty query matches every voter.
+    """
+    with _index.lock:
+        _sync(_index)
+        if not query.split():
+            start = bisect.bisect_right(_index.ids, after)
+            return len(_index.ids), _index.ids[start:start + limit]
+        matches = _index.search(query)
+    count = len(matches)
+    if after:
+        matches = [voter_id for voter_id in matches if voter_id > after]
+    return count, heapq.nsmallest(limit, matches)
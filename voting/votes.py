@@ -0,0 +1,257 @@
+"""
+Recording of submitted ballots and the per-candidate tallies kept with them,
+and resetting the election.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min, Sum
+
+from .models import Ballot, Candidate, PaperTally, Position, Ranking, Station, Voter, Votes, VoteTally
+from .ballot import bump_ballot_version
+from .storage import ballot_storage, count_votes, pack_ids
+
+TALLY_CACHE_KEY = 'voting:tallies'
+VOTE_VERSION_KEY = 'voting:vote_version'
+RESET_CHUNK_SIZE = 50000
+
+
+class AlreadyVoted(Exception):
+    pass
+
+
+def record_ballot(voter, selections, key='', ranked=()):
+    """
+    Write a validated ballot ({position_id: [candidate_id, ...]}, as returned
+    by BallotSchema.clean) and mark the voter as voted, all in one transaction.
+
+    For the positions in `ranked` (BallotSchema.ranked) the candidates are a
+    preference order: it is stored as a Ranking and only the first
+    preference counts as a vote.
+
+    The ballot is claimed with a conditional UPDATE on Voter.voted, so of two
+    concurrent submissions only one can write votes; the other gets
+    AlreadyVoted without any row or table lock being taken up front.
+
+    `key` is the client's idempotency key; it is stored with the claim so a
+    retried submission can be recognised (see is_replay).
+    """
+    rankings = [
+        Ranking(voter=voter, position_id=position_id, candidates=pack_ids(chosen))
+        for position_id, chosen in selections.items()
+        if position_id in ranked
+    ]
+    selections = {
+        position_id: chosen[:1] if position_id in ranked else chosen
+        for position_id, chosen in selections.items()
+    }
+    candidate_ids = [
+        candidate_id
+        for position_id, chosen in selections.items()
+        for candidate_id in chosen
+    ]
+    with transaction.atomic():
+        claimed = Voter.objects.filter(id=voter.id, voted=False).update(
+            voted=True, ballot_key=key)
+        if claimed != 1:
+            raise AlreadyVoted
+        if ballot_storage():
+            Ballot.objects.create(voter=voter, candidates=pack_ids(candidate_ids))
+        else:
+            Votes.objects.bulk_create([
+                Votes(voter=voter, position_id=position_id, candidate_id=candidate_id)
+                for position_id, chosen in selections.items()
+                for candidate_id in chosen
+            ])
+        if rankings:
+            Ranking.objects.bulk_create(rankings)
+        add_to_tallies(candidate_ids, shard_for(voter.id))
+    voter.voted = True
+    voter.ballot_key = key
+    return len(candidate_ids)
+
+
+def is_replay(voter, key):
+    """True if `key` is the idempotency key of the voter's recorded ballot"""
+    if not key:
+        return False
+    return Voter.objects.filter(id=voter.id, voted=True, ballot_key=key).exists()
+
+
+def get_vote_version():
+    """Changes whenever tallies change; used to key cached results"""
+    version = cache.get(VOTE_VERSION_KEY)
+    if version is None:
+        cache.add(VOTE_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VOTE_VERSION_KEY)
+    return version
+
+
+def bump_vote_version():
+    try:
+        cache.incr(VOTE_VERSION_KEY)
+    except ValueError:
+        cache.set(VOTE_VERSION_KEY, time.time_ns(), None)
+
+
+def tally_shards():
+    return getattr(settings, 'VOTE_TALLY_SHARDS', 1)
+
+
+def shard_for(voter_id):
+    return voter_id % tally_shards()
+
+
+def create_tallies(candidate_ids):
+    """Create the (empty) tally shards of each candidate in `candidate_ids`"""
+    VoteTally.objects.bulk_create([
+        VoteTally(candidate_id=cid, shard=shard)
+        for cid in candidate_ids
+        for shard in range(tally_shards())
+    ], batch_size=500, ignore_conflicts=True)
+
+
+def add_to_tallies(candidate_ids, shard, amount=1):
+    """Add `amount` to one shard of each candidate in `candidate_ids` (no repeats)"""
+    if not candidate_ids:
+        return
+    transaction.on_commit(bump_vote_version)
+    updated = VoteTally.objects.filter(candidate_id__in=candidate_ids, shard=shard).update(
+        votes=F('votes') + amount)
+    if updated < len(candidate_ids) and amount > 0:
+        # Candidates created without tally rows (e.g. through bulk_create).
+        # Taking votes off never needs one: there is nothing to take.
+        existing = set(VoteTally.objects.filter(
+            candidate_id__in=candidate_ids, shard=shard).values_list('candidate_id', flat=True))
+        missing = [cid for cid in candidate_ids if cid not in existing]
+        VoteTally.objects.bulk_create(
+            [VoteTally(candidate_id=cid, shard=shard) for cid in missing], ignore_conflicts=True)
+        VoteTally.objects.filter(candidate_id__in=missing, shard=shard).update(
+            votes=F('votes') + amount)
+
+
+def get_tallies(fresh=False):
+    """
+    {candidate_id: votes}, summed over shards. Unless `fresh` is set the
+    result may be up to VOTE_TALLY_CACHE_SECONDS old.
+    """
+    if not fresh:
+        tallies = cache.get(TALLY_CACHE_KEY)
+        if tallies is not None:
+            return tallies
+    tallies = dict(
+        VoteTally.objects.values_list('candidate_id').annotate(total=Sum('votes')).order_by()
+    )
+    cache.set(TALLY_CACHE_KEY, tallies, getattr(settings, 'VOTE_TALLY_CACHE_SECONDS', 5))
+    return tallies
+
+
+def reset_tallies():
+    VoteTally.objects.update(votes=0)
+    cache.delete(TALLY_CACHE_KEY)
+    bump_vote_version()
+
+
+def reset_election(progress=None, chunk_size=RESET_CHUNK_SIZE):
+    """
+    Remove every vote, ballot, ranking and paper count, zero the tallies
+    and let every voter vote again. Returns {table label: rows removed}.
+
+    On PostgreSQL the tables are truncated. Elsewhere rows are deleted in
+    id ranges of `chunk_size`, each range in its own short transaction, so
+    the write lock is never held for long; `progress(label, removed,
+    total)` is called after every range.
+    """
+    removed = {
+        model._meta.label: _clear_table(model, progress, chunk_size)
+        for model in (Votes, Ballot, Ranking, PaperTally)
+    }
+    # A handful of rows, and nothing left to cascade to
+    Station.objects.all().delete()
+    Voter.objects.update(voted=False, verified=False, ballot_key='')
+    reset_tallies()
+    bump_ballot_version()
+    return removed
+
+
+def _clear_table(model, progress, chunk_size):
+    label = model._meta.label
+    bounds = model.objects.aggregate(low=Min('id'), high=Max('id'), total=Count('id'))
+    total = bounds['total']
+    if not total:
+        return 0
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE TABLE {connection.ops.quote_name(model._meta.db_table)}")
+        if progress:
+            progress(label, total, total)
+        return total
+
+    removed = 0
+    for low in range(bounds['low'], bounds['high'] + 1, chunk_size):
+        # Nothing cascades from these tables, so this is a plain DELETE
+        removed += model.objects.filter(id__gte=low, id__lt=low + chunk_size).delete()[0]
+        if progress:
+            progress(label, removed, total)
+    return removed
+
+
+def rebuild_tallies():
+    """
+    Recompute every tally from the stored votes (see storage.count_votes).
+    Ballots are kept from being recorded while the votes are counted, or
+    they would be missing from the new tallies.
+    """
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # Waits for ballots being written and blocks new ones until the commit
+            tables = ", ".join(
+                connection.ops.quote_name(model._meta.db_table)
+                for model in (Votes, Ballot, Ranking, PaperTally, VoteTally))
+            with connection.cursor() as cursor:
+                cursor.execute(f"LOCK TABLE {tables} IN SHARE ROW EXCLUSIVE MODE")
+        elif connection.vendor != 'sqlite':
+            list(VoteTally.objects.select_for_update().values_list('id', flat=True))
+        # On SQLite this must be the first statement: it takes the write lock
+        # (waiting out ballots being written), so the count below sees every
+        # committed ballot and no new one. A read before it would hold a
+        # shared lock that SQLite fails to upgrade at once when busy.
+        VoteTally.objects.all().delete()
+        counts = count_votes()
+        # The whole count goes to shard 0, the other shards start again at zero
+        VoteTally.objects.bulk_create([
+            VoteTally(candidate_id=cid, shard=shard, votes=counts.get(cid, 0) if shard == 0 else 0)
+            for cid in Candidate.objects.values_list('id', flat=True)
+            for shard in range(tally_shards())
+        ], batch_size=500)
+    cache.delete(TALLY_CACHE_KEY)
+    bump_vote_version()
+    return sum(counts.values())
+
+
+def results_by_position():
+    """
+    Every position in ballot order with its candidates and their tallies,
+    from a single query:
+    [{'id', 'name', 'max_vote', 'ranked', 'candidates': [{'id', 'name', 'votes'}, ...]}, ...]
+
+    For ranked positions the votes are first preferences.
+    """
+    rows = (
+        Position.objects
+        .order_by('priority', 'id', 'candidate__id')
+        .values_list('id', 'name', 'max_vote', 'ranked', 'candidate__id', 'candidate__fullname')
+        .annotate(votes=Sum('candidate__tallies__votes'))
+    )
+    results = []
+    for position_id, name, max_vote, ranked, candidate_id, fullname, votes in rows:
+        if not results or results[-1]['id'] != position_id:
+            results.append({
+                'id': position_id, 'name': name, 'max_vote': max_vote, 'ranked': ranked,
+                'candidates': [],
+            })
+        if candidate_id is not None:
+            results[-1]['candidates'].append({'id': candidate_id, 'name': fullname, 'votes': votes or 0})
+    return results